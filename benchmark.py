@@ -0,0 +1,754 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Benchmarks for the link handlers and the team cache, run in-process with the
+App Engine services replaced by the SDK's local stubs and the FIRST website by
+canned responses.
+
+Run from the application directory with the App Engine SDK installed:
+
+  python benchmark.py wsgi --requests 5000 --latency memcache=0.001 \
+      --latency datastore_v3=0.01 --latency urlfetch=0.2
+  python benchmark.py routing
+
+The suites are:
+  wsgi     Replays a weighted mix of typical links against the WSGI
+           application and reports requests/sec and p50/p99 latency and RPCs
+           per request for each route. Each service can be given a simulated
+           latency. With --threads, requests are served concurrently as on a
+           threadsafe instance, and any answered with a server error is
+           counted against its route.
+  routing  Times finding the handler for each path in the routing corpus,
+           with the per-segment index against a linear scan of one regex per
+           route as webapp does.
+  eventcodes
+           Times mapping event codes to team list and TBA codes, with the
+           original if/elif chain against the eventcodes.json lookups.
+  redirect Times rendering the client-side redirect page, with the template
+           rendered per request against RenderRedirect, in microseconds per
+           page and megabytes of page per second.
+  storeteams
+           Counts the RPCs made storing a page of the team list, with the
+           original query and put per team against the batched StoreTeams.
+           Datastore batches are split into concurrent RPCs of ten entity
+           groups each, so RPCs overstate round trips for StoreTeams. The
+           stubs serve RPCs one at a time, so with service latencies given,
+           its times are an upper bound.
+  schemas  Times looking up and updating a team, and counts the RPCs made,
+           with records found by querying on the team number as originally
+           stored against records keyed by team number.
+  parse    Times parsing synthetic team list pages of 250 to 25000 rows and
+           measures the peak memory it adds, with the original findall
+           against IterTeams on the whole page and on the page in chunks.
+
+Results are appended to benchmark_results.json and compared with the previous
+run of the same suite with the same settings, so that regressions show up
+between runs.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import threading
+import time
+import wsgiref.util
+from StringIO import StringIO
+
+try:
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+except ImportError:
+  pass
+
+# Selects the template library bundled for the python27 runtime, as in
+# production.
+os.environ.setdefault('APPENGINE_RUNTIME', 'python27')
+
+from google.appengine.api import apiproxy_stub
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import testbed
+
+# The links to replay and how often each occurs relative to the others.
+corpus = [
+  ('/t/254', 30),
+  ('/t/1114', 10),
+  ('/t/99999', 5),
+  ('/w/1114', 10),
+  ('/m/254', 5),
+  ('/tba/254', 10),
+  ('/tba/254/2018', 5),
+  ('/e/m/casj/2018', 10),
+  ('/e/casj', 5),
+  ('/api/roster/casj/2018', 5),
+  ('/api/teamevents/254/2018', 5),
+  ('/r', 3),
+  ('/', 7),
+]
+
+# One path for each form of link the application serves, plus an unknown one.
+routingCorpus = [
+  '/t/254', '/teams/ontario/2018', '/t/ontario', '/t', '/w/254', '/map/254',
+  '/tba/254/2018', '/tba/254', '/tba', '/cdm/254',
+  '/events/schedule/casj/2018', '/events/matchresults/casj',
+  '/events/rankings/casj', '/events/awards/casj', '/events/agenda/casj',
+  '/events/tba/casj', '/event/casj/2018', '/e/casj', '/e/s/casj/2018',
+  '/e/m/casj', '/e/r/casj', '/e/a/casj', '/e/g/casj', '/e/tba/carv/2018',
+  '/regionals/2018', '/r', '/championship', '/c', '/dr/ont', '/documents',
+  '/docs/2018', '/d', '/kitofparts', '/k', '/updates', '/u', '/blog', '/b',
+  '/forums', '/f', '/qa', '/q', '/news', '/n', '/youtube', '/y', '/tims',
+  '/stims', '/vims', '/kickoff', '/ko', '/fmsdump', '/calendar', '/cal',
+  '/cookie', '/robots.txt', '/usfirst.org', '/no/such/link',
+]
+
+# Event codes as typed in links: aliases, full division names and others.
+eventCorpus = [
+  'arc', 'cars', 'carv', 'cur', 'dal', 'dar', 'gal', 'hop', 'new', 'roe', 'tes',
+  'tur', 'ein', 'archimedes', 'carson', 'carver', 'curie', 'daly', 'darwin',
+  'galileo', 'hopper', 'newton', 'roebling', 'tesla', 'turing', 'einstein',
+  'casj', 'onwa', 'cmptx', 'mndu',
+]
+
+# Teams stored before the run, as (tpid, number).
+seedTeams = [(i * 7 + 1000, i) for i in range(1, 2000)]
+
+# Details that the fake FIRST search returns for every team.
+detailsTemplate = {
+  'team_web_url': 'www.example.com',
+  'team_city': 'Kitchener',
+  'team_stateprov': 'ON',
+  'team_country': 'Canada',
+  'team_postalcode': 'N2G 1H6',
+}
+
+def TeamListPage(teams):
+  '''
+  Returns a page of the FIRST team list containing the given teams.
+  '''
+  return ''.join('<a href="index.lasso?page=team_details&tpid=%d&'
+                 '-session=myarea:BENCH"><b>%d</b></a>\n' % team
+                 for team in teams)
+
+class FakeUrlFetchStub(apiproxy_stub.APIProxyStub):
+  '''
+  Stands in for urlfetch, answering FIRST team searches and team lists (both
+  the list of all teams and event team lists) with canned content.
+  '''
+  def __init__(self):
+    super(FakeUrlFetchStub, self).__init__('urlfetch')
+
+  def _Dynamic_Fetch(self, request, response):
+    url = request.url()
+    if '_search' in url:
+      tpids = url.split('_id:(')[1].split(')')[0].split('%20OR%20')
+      content = json.dumps({'hits': {'hits': [
+          {'_id': tpid, '_source': detailsTemplate} for tpid in tpids]}})
+    else:
+      content = TeamListPage(seedTeams[:250])
+    response.set_statuscode(200)
+    response.set_content(content)
+    response.set_finalurl(url)
+
+def DelayRpc(latencies):
+  '''
+  Returns an apiproxy hook that sleeps for the configured latency of each
+  service before the call goes through.
+  '''
+  def Hook(service, call, request, response):
+    time.sleep(latencies.get(service, 0))
+  return Hook
+
+def ActivateStubs(latencies={}):
+  '''
+  Replaces the App Engine services with the SDK's local stubs and FIRST with
+  FakeUrlFetchStub, delaying each call by the latency given for its service.
+  Returns the testbed, to be deactivated once done.
+  '''
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_memcache_stub()
+  bed.init_datastore_v3_stub()
+  bed.init_taskqueue_stub()
+  apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', FakeUrlFetchStub())
+  if latencies:
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'latency', DelayRpc(latencies))
+  return bed
+
+def MakeEnviron(path):
+  '''
+  Returns a WSGI environment for a GET of the given path.
+  '''
+  environ = {
+    'REQUEST_METHOD': 'GET',
+    'PATH_INFO': path,
+    'QUERY_STRING': '',
+    'HTTP_USER_AGENT': 'benchmark',
+    'wsgi.input': StringIO(),
+  }
+  wsgiref.util.setup_testing_defaults(environ)
+  return environ
+
+def Percentile(sortedValues, fraction):
+  return sortedValues[min(len(sortedValues) - 1,
+                          int(len(sortedValues) * fraction))]
+
+def TimeCalls(func, inputs, iterations):
+  '''
+  Returns the mean time in microseconds of calling func on each of the given
+  inputs, over the best of three runs of the given number of passes.
+  '''
+  best = None
+  for run in xrange(3):
+    startTime = time.time()
+    for i in xrange(iterations):
+      for value in inputs:
+        func(value)
+    elapsed = time.time() - startTime
+    if best is None or elapsed < best:
+      best = elapsed
+  return best * 1e6 / (iterations * len(inputs))
+
+def RunWsgi(args):
+  '''
+  Replays requests drawn from the corpus, spread over the given number of
+  concurrent threads, and returns the results keyed by route along with the
+  overall requests per second.
+  '''
+  bed = ActivateStubs()
+
+  # Import once the stubs are in place so that the stats RPC hook lands on them.
+  import frclinks
+  import roster
+  import stats
+  import team
+  from google.appengine.ext import webapp
+
+  for start in xrange(0, len(seedTeams), 250):
+    team.StoreTeams('2018', start,
+                    TeamListPage(seedTeams[start:start + 250]))
+  roster.ScrapeRosters('2018', ['casj', 'onwa'],
+                       frclinks.EventTeamListPage.GetUrl)
+  apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+      'latency', DelayRpc(args.latencies))
+
+  stats.sampleRate = 1.0
+  # Serve the whole corpus, including the routes production sends elsewhere.
+  appRoutes = [('.*', frclinks.DispatchPage)]
+  routeName = frclinks.RouteNamer(appRoutes)
+  app = stats.StatsMiddleware(webapp.WSGIApplication(appRoutes), routeName)
+
+  paths = [path for path, weight in corpus for i in range(weight)]
+  latenciesByRoute = {}
+  errorsByRoute = {}
+  resultsLock = threading.Lock()
+
+  def Replay(count, generator):
+    for i in xrange(count):
+      path = generator.choice(paths)
+      statuses = []
+      requestStart = time.time()
+      ''.join(app(MakeEnviron(path),
+                  lambda status, headers: statuses.append(status)))
+      latency = (time.time() - requestStart) * 1000
+      route = routeName(path)
+      with resultsLock:
+        latenciesByRoute.setdefault(route, []).append(latency)
+        if not statuses or statuses[0].startswith('5'):
+          errorsByRoute[route] = errorsByRoute.get(route, 0) + 1
+
+  workers = []
+  for i in xrange(args.threads):
+    count = args.requests / args.threads + (i < args.requests % args.threads)
+    workers.append(threading.Thread(
+        target=Replay, args=(count, random.Random(args.seed + i))))
+  startTime = time.time()
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  elapsed = time.time() - startTime
+  bed.deactivate()
+
+  routeStats = stats.GetStats()
+  results = {}
+  for route, routeLatencies in latenciesByRoute.iteritems():
+    routeLatencies.sort()
+    count = len(routeLatencies)
+    results[route] = {
+      'requests': count,
+      'errors': errorsByRoute.get(route, 0),
+      'p50Ms': round(Percentile(routeLatencies, 0.5), 2),
+      'p99Ms': round(Percentile(routeLatencies, 0.99), 2),
+      'rpcsPerRequest': dict(
+          (rpc, round(float(rpcCount) / count, 2))
+          for rpc, rpcCount in routeStats[route]['rpcs'].iteritems()),
+    }
+  return results, {'requestsPerSecond': round(args.requests / elapsed, 1)}
+
+def LinearRoutes(routes):
+  '''
+  Returns the given route table as a list of one case-insensitive regex per
+  route and path segment, in the order webapp would try them.
+  '''
+  linearRoutes = []
+  for segments, pattern, handler in routes:
+    for segment in segments:
+      linearRoutes.append((re.compile(
+          r'/%s(?:/|$)(?:%s)/?$' % (re.escape(segment), pattern),
+          re.IGNORECASE), handler))
+  return linearRoutes
+
+def RunRouting(args):
+  '''
+  Times finding the handler for every path in the routing corpus, with a linear
+  scan of the route table against the per-segment index, and times resolving
+  the destination of each path with and without the resolve cache.
+  '''
+  import frclinks
+  linearRoutes = LinearRoutes(frclinks.routes)
+
+  def ScanRoutes(path):
+    for compiledPattern, handler in linearRoutes:
+      match = compiledPattern.match(path)
+      if match:
+        return handler, match.groupdict()
+    return frclinks.InstructionPage, {}
+
+  # Check that both find the same handlers before timing them.
+  for path in routingCorpus:
+    if ScanRoutes(path)[0] is not frclinks.Dispatch(path)[0]:
+      raise AssertionError('Routes disagree on ' + path)
+
+  def ResolveUncached(path):
+    handlerClass, params = frclinks.Dispatch(frclinks.NormalizePath(path))
+    if issubclass(handlerClass, frclinks.RedirectPage):
+      return handlerClass.GetUrl(**params)
+
+  frclinks.GetRouteIndex()
+  for path in routingCorpus:
+    frclinks.Resolve(path)
+  variants = [
+    ('linear scan', ScanRoutes),
+    ('segment index', frclinks.Dispatch),
+    ('resolve uncached', ResolveUncached),
+    ('resolve cache', frclinks.Resolve),
+  ]
+  results = {}
+  for name, func in variants:
+    results[name] = {
+      'usPerRequest': round(TimeCalls(func, routingCorpus, args.iterations), 2),
+    }
+  linearTime = results['linear scan']['usPerRequest']
+  for result in results.itervalues():
+    result['speedup'] = round(linearTime / result['usPerRequest'], 1)
+  return results, {'paths': len(routingCorpus)}
+
+def BaselineEventCodes(event):
+  '''
+  Returns the team list and TBA codes for the given event code the way the
+  handlers derived them before the codes moved to eventcodes.json.
+  '''
+  if event == 'arc':
+    event = 'archimedes'
+  elif event == 'cars':
+    event = 'carson'
+  elif event == 'carv':
+    event = 'carver'
+  elif event == 'cur':
+    event = 'curie'
+  elif event == 'dal':
+    event = 'daly'
+  elif event == 'dar':
+    event = 'darwin'
+  elif event == 'gal':
+    event = 'galileo'
+  elif event == 'hop':
+    event = 'hopper'
+  elif event == 'new':
+    event = 'newton'
+  elif event == 'roe':
+    event = 'roebling'
+  elif event == 'tes':
+    event = 'tesla'
+  elif event == 'tur':
+    event = 'turing'
+  elif event == 'ein':
+    event = 'einstein'
+
+  teamListEvent = event
+  if event in ['carver', 'galileo', 'hopper', 'newton', 'roebling', 'turing']:
+    teamListEvent = 'cmptx&division=' + event
+  elif event in ['archimedes', 'carson', 'curie', 'daly', 'darwin', 'tesla']:
+    teamListEvent = 'cmpmo&division=' + event
+
+  tbaEvent = event
+  if event in ['archimedes', 'curie', 'daly', 'darwin', 'galileo', 'hopper',
+      'newton', 'roebling', 'tesla', 'turing']:
+    tbaEvent = event[:3]
+  elif event in ['carson', 'carver']:
+    tbaEvent = event[:4]
+  return teamListEvent, tbaEvent
+
+def RunEventCodes(args):
+  '''
+  Times deriving the team list and TBA codes of each event in the corpus, with
+  the original if/elif chain and list scans against the eventcodes.json
+  lookups.
+  '''
+  import frclinks
+
+  def TableEventCodes(event):
+    event = frclinks.GetEvent(event)
+    teamListEvent = event
+    parent = frclinks.GetDivisionParent(event, frclinks.defaultYear)
+    if parent:
+      teamListEvent = parent + '&division=' + event
+    return (teamListEvent,
+            frclinks.GetTbaEvent(event, frclinks.defaultYear))
+
+  for event in eventCorpus:
+    if BaselineEventCodes(event) != TableEventCodes(event):
+      raise AssertionError('Event codes disagree on ' + event)
+
+  results = {}
+  for name, func in [('if/elif chain', BaselineEventCodes),
+                     ('eventcodes.json', TableEventCodes)]:
+    results[name] = {
+      'usPerEvent': round(TimeCalls(func, eventCorpus, args.iterations * 10),
+                          3),
+    }
+  results['eventcodes.json']['speedup'] = round(
+      results['if/elif chain']['usPerEvent'] /
+      results['eventcodes.json']['usPerEvent'], 1)
+  return results, {'events': len(eventCorpus)}
+
+def RunRedirect(args):
+  '''
+  Times rendering the client-side redirect page for the destination of every
+  redirect in the routing corpus, rendering the template on each call as the
+  handlers originally did against RenderRedirect.
+  '''
+  import frclinks
+  from google.appengine.ext.webapp import template
+
+  urls = [url for url in map(frclinks.Resolve, routingCorpus) if url]
+
+  def RenderTemplate(url):
+    return template.render('templates/redirect.html', {'url': url})
+
+  results = {}
+  for name, func in [('template.render', RenderTemplate),
+                     ('RenderRedirect', frclinks.RenderRedirect)]:
+    bodyBytes = sum(len(func(url)) for url in urls) / float(len(urls))
+    usPerCall = TimeCalls(func, urls, args.iterations)
+    results[name] = {
+      'usPerCall': round(usPerCall, 2),
+      'megabytesPerSecond': round(bodyBytes / usPerCall, 1),
+    }
+  results['RenderRedirect']['speedup'] = round(
+      results['template.render']['usPerCall'] /
+      results['RenderRedirect']['usPerCall'], 1)
+  return results, {'urls': len(urls)}
+
+def BaselineStoreTeams(year, content):
+  '''
+  Stores the teams on the given page of the FIRST list of all teams the way
+  ScrapeTeams originally did, with a query or two and a put for each team.
+  '''
+  from google.appengine.api import memcache
+  from team import TeamTpid
+
+  teamResults = re.findall(r'tpid=(\d+)[A-Za-z0-9=&;\-:]*?"><b>(\d+)', content)
+  for teamResult in teamResults:
+    teamNumber = int(teamResult[1])
+    teamTpid = teamResult[0]
+    teamQuery = TeamTpid.all().filter('number =', int(teamNumber))
+    if teamQuery.count() == 0:
+      # Insert a new record for the team.
+      newTeam = TeamTpid()
+      newTeam.number = int(teamNumber)
+      newTeam.tpid = int(teamTpid)
+      newTeam.year = int(year)
+      newTeam.put()
+      memcache.set(str(teamNumber), teamTpid, namespace="Team")
+    elif teamQuery.filter('year <', int(year)).count() != 0:
+      # Updated the existing team record if this tpid is more recent.
+      team = teamQuery.fetch(1)[0]
+      team.tpid = int(teamTpid)
+      team.year = int(year)
+      team.put()
+      memcache.set(str(teamNumber), teamTpid, namespace="Team")
+  return teamResults
+
+def CountRpcs(rpcCounts):
+  '''
+  Returns an apiproxy hook that counts each call in the given dict.
+  '''
+  def Hook(service, call, request, response):
+    rpcCounts[service + '.' + call] = rpcCounts.get(service + '.' + call, 0) + 1
+  return Hook
+
+def RunStoreTeams(args):
+  '''
+  Counts the RPCs made and times storing a page of 250 teams, as the original
+  per-team code did and with StoreTeams, when the teams are new, when they are
+  unchanged and when a newer season replaces them.
+  '''
+  import team
+
+  page = TeamListPage(seedTeams[:250])
+  implementations = [
+    ('baseline', BaselineStoreTeams),
+    ('StoreTeams', lambda year, content: team.StoreTeams(year, 0, content)),
+  ]
+  results = {}
+  for name, storeTeams in implementations:
+    bed = ActivateStubs(args.latencies)
+    team.teamCache.Clear()
+    team.knownTeams = None
+    rpcCounts = {}
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'count', CountRpcs(rpcCounts))
+    for scenario, year in [('new', '2017'), ('unchanged', '2017'),
+                           ('updated', '2018')]:
+      rpcCounts.clear()
+      startTime = time.time()
+      storeTeams(year, page)
+      results['%s %s' % (name, scenario)] = {
+        'ms': round((time.time() - startTime) * 1000, 1),
+        'rpcs': sum(rpcCounts.values()),
+        'rpcsByCall': dict(rpcCounts),
+      }
+    bed.deactivate()
+  return results, {'teamsPerPage': 250}
+
+def RunSchemas(args):
+  '''
+  Compares looking up and updating teams stored the original way, one record
+  per team and season found by querying on its number, with records keyed by
+  team number.
+  '''
+  from google.appengine.ext import db
+  from team import TeamTpid
+
+  numbers = [number for tpid, number in seedTeams[::10]]
+  def QueryLookup(number):
+    return TeamTpid.all().filter('number =', number).get()
+  def KeyLookup(number):
+    return TeamTpid.get_by_key_name(str(number))
+  def QueryUpdate(number):
+    team = QueryLookup(number)
+    team.year += 1
+    team.put()
+  def KeyUpdate(number):
+    team = KeyLookup(number)
+    team.year += 1
+    team.put()
+
+  schemas = [
+    ('query by number', None, QueryLookup, QueryUpdate),
+    ('keyed by number', str, KeyLookup, KeyUpdate),
+  ]
+  results = {}
+  for name, keyName, lookup, update in schemas:
+    bed = ActivateStubs(args.latencies)
+    rpcCounts = {}
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'count', CountRpcs(rpcCounts))
+    teams = []
+    for tpid, number in seedTeams:
+      teams.append(TeamTpid(key_name=keyName and keyName(number),
+                            number=number, tpid=tpid, year=2018))
+    for i in xrange(0, len(teams), 500):
+      db.put(teams[i:i + 500])
+
+    result = {}
+    for operation, func in [('lookup', lookup), ('update', update)]:
+      rpcCounts.clear()
+      startTime = time.time()
+      for number in numbers:
+        func(number)
+      elapsed = time.time() - startTime
+      result[operation + 'Us'] = round(elapsed * 1e6 / len(numbers), 1)
+      result[operation + 'Rpcs'] = dict(
+          (call, round(float(count) / len(numbers), 2))
+          for call, count in rpcCounts.iteritems())
+    results[name] = result
+    bed.deactivate()
+  return results, {'teams': len(seedTeams), 'lookups': len(numbers)}
+
+def MeasureInChild(setup, run):
+  '''
+  Calls run on the result of setup in a forked child process, returning the
+  time run took in milliseconds and how far it raised the child's peak memory
+  use in kilobytes, so that runs don't share a high-water mark.
+  '''
+  readFd, writeFd = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close(readFd)
+    data = setup()
+    startMaxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    startTime = time.time()
+    run(data)
+    elapsed = time.time() - startTime
+    endMaxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    os.write(writeFd, json.dumps([elapsed * 1000, endMaxRss - startMaxRss]))
+    os._exit(0)
+  os.close(writeFd)
+  output = os.read(readFd, 4096)
+  os.close(readFd)
+  os.waitpid(pid, 0)
+  return json.loads(output)
+
+def RunParse(args):
+  '''
+  Times parsing synthetic team list pages of increasing size, and measures the
+  memory it takes, with the original findall against IterTeams on the whole
+  page and IterTeams on the page as it arrives in chunks.
+  '''
+  import team
+
+  oldTeamRe = re.compile(r'tpid=(\d+)[A-Za-z0-9=&;\-:]*?"><b>(\d+)')
+  chunkRows = 100
+
+  def Chunks(teams):
+    # Generates the page a chunk at a time, as a streamed response would
+    # arrive, without ever holding all of it.
+    for i in xrange(0, len(teams), chunkRows):
+      yield TeamListPage(teams[i:i + chunkRows])
+
+  def CountTeams(teams):
+    count = 0
+    for teamResult in teams:
+      count += 1
+    return count
+
+  # Each variant is given the teams and receives the page from them, so that
+  # holding the whole page counts against it.
+  variants = [
+    ('findall', lambda teams: len(oldTeamRe.findall(TeamListPage(teams)))),
+    ('IterTeams',
+     lambda teams: CountTeams(team.IterTeams(TeamListPage(teams)))),
+    ('IterTeams chunked',
+     lambda teams: CountTeams(team.IterTeams(Chunks(teams)))),
+  ]
+  results = {}
+  for rows in [250, 2500, 25000]:
+    teams = [(i * 7 + 1000, i) for i in xrange(1, rows + 1)]
+    for name, run in variants:
+      ms, peakKb = MeasureInChild(lambda: teams, run)
+      results['%s %d rows' % (name, rows)] = {
+        'ms': round(ms, 1),
+        'peakKb': peakKb,
+      }
+  return results, {'chunkRows': chunkRows}
+
+# The benchmark suites, with the settings that runs must share to be compared.
+suites = {
+  'wsgi': (RunWsgi, ['requests', 'threads', 'latencies', 'seed']),
+  'routing': (RunRouting, ['iterations']),
+  'eventcodes': (RunEventCodes, ['iterations']),
+  'redirect': (RunRedirect, ['iterations']),
+  'storeteams': (RunStoreTeams, ['latencies']),
+  'schemas': (RunSchemas, ['latencies']),
+  'parse': (RunParse, []),
+}
+
+def Report(results, summary, previous):
+  '''
+  Prints the results, with the change in each number from the previous run
+  where there is one.
+  '''
+  previousResults = previous and previous['results'] or {}
+  for name in sorted(results):
+    cells = []
+    for metric, value in sorted(results[name].iteritems()):
+      cell = '%s=%s' % (metric, json.dumps(value, sort_keys=True))
+      previousValue = previousResults.get(name, {}).get(metric)
+      if isinstance(value, (int, float)) and previousValue is not None:
+        cell += ' (%+g)' % round(value - previousValue, 2)
+      cells.append(cell)
+    print '%-28s %s' % (name, '  '.join(cells))
+  for metric, value in sorted(summary.iteritems()):
+    line = '%s: %s' % (metric, value)
+    if previous and metric in previous['summary']:
+      line += ' (previous %s)' % previous['summary'][metric]
+    print line
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__.split('\n\n')[0],
+      formatter_class=argparse.RawDescriptionHelpFormatter,
+      epilog=__doc__.split('\n\n', 3)[3])
+  parser.add_argument('suite', nargs='?', default='wsgi', choices=suites)
+  parser.add_argument('--requests', type=int, default=2000)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--threads', type=int, default=1,
+                      help='number of requests to serve concurrently')
+  parser.add_argument('--latency', action='append', default=[],
+                      metavar='SERVICE=SECONDS',
+                      help='simulated latency of an App Engine service, e.g. '
+                           'memcache=0.001; may be repeated')
+  parser.add_argument('--iterations', type=int, default=200,
+                      help='passes over the inputs of a timing suite')
+  parser.add_argument('--results', default='benchmark_results.json')
+  args = parser.parse_args()
+
+  args.latencies = {}
+  for latency in args.latency:
+    service, seconds = latency.split('=')
+    args.latencies[service] = float(seconds)
+
+  try:
+    with open(args.results) as resultsFile:
+      history = json.load(resultsFile)
+  except IOError:
+    history = []
+
+  runSuite, settingNames = suites[args.suite]
+  settings = dict((name, getattr(args, name)) for name in settingNames)
+  results, summary = runSuite(args)
+  previous = None
+  for run in reversed(history):
+    if run.get('suite') == args.suite and run['settings'] == settings:
+      previous = run
+      break
+  Report(results, summary, previous)
+
+  history.append({
+    'suite': args.suite,
+    'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    'settings': settings,
+    'results': results,
+    'summary': summary,
+  })
+  with open(args.results, 'w') as resultsFile:
+    json.dump(history, resultsFile, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+  main()
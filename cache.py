@@ -0,0 +1,80 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Provides a small in-process cache for memoizing values within an instance.
+"""
+
+import collections
+import threading
+import time
+
+class LruCache(object):
+  '''
+  Holds up to a fixed number of values, evicting the least recently used one
+  when full, and optionally expiring values after a number of seconds. Counts
+  hits and misses so that its effectiveness can be checked. Safe to share
+  between threads.
+  '''
+  def __init__(self, capacity, ttl=None):
+    self.capacity = capacity
+    self.ttl = ttl
+    self.entries = collections.OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def Get(self, key):
+    '''
+    Returns the value cached for the given key, or None if there isn't one or
+    it has expired.
+    '''
+    with self.lock:
+      entry = self.entries.pop(key, None)
+      if entry is None or (entry[1] is not None and entry[1] < time.time()):
+        self.misses += 1
+        return None
+      # Re-insert the entry to mark it as the most recently used.
+      self.entries[key] = entry
+      self.hits += 1
+      return entry[0]
+
+  def Set(self, key, value):
+    '''
+    Caches the given value, evicting the least recently used entry if needed.
+    '''
+    expireTime = None
+    if self.ttl is not None:
+      expireTime = time.time() + self.ttl
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = (value, expireTime)
+      if len(self.entries) > self.capacity:
+        self.entries.popitem(last=False)
+
+  def Clear(self):
+    '''
+    Discards all cached values without resetting the counters.
+    '''
+    with self.lock:
+      self.entries.clear()
@@ -26,39 +26,34 @@ pages, event team lists, documents and updates. Intended to compensate for the
 FIRST website's use of non-memorable URLs and lack of ease of navigation.
 """
 
+import hashlib
 import json
 import os
 import re
 import time
 import urllib
 
-from google.appengine.api import urlfetch
 from google.appengine.ext import webapp
-from google.appengine.ext.webapp import template
 from google.appengine.ext.webapp.util import run_wsgi_app
 
-from team import FlushTeams
-from team import LookupTeam
-from team import ScrapeTeam
-from team import ScrapeTeams
+from cache import LruCache
+from stats import GetStats
+from stats import InstallRpcHook
+from stats import StatsMiddleware
+from stats import Timed
+from upstream import UnavailableError
 
-# Extracts the team number from the end of the URL.
+# Extracts team numbers from a list.
 numberRe = re.compile(r'\d+')
 
-# Extracts the area code from the end of the URL.
-areaRe = re.compile(r'[A-Za-z\-]+')
+# Matches an event code and optional year following the handler's path segment.
+eventPattern = r'(?P<event>[A-Za-z]+\d?)(?:/(?P<year>\d{4}))?'
 
-# Extracts the event code from the end of the URL.
-eventRe = re.compile(r'[A-Za-z]+\d?')
+# Matches one event code and optional year in a list of events.
+eventRe = re.compile(eventPattern + '$')
 
-# Extracts the year from the end of the URL.
-yearRe = re.compile(r'\d{4}')
-
-# Get the team and the year from the URL
-blueAllianceRe = re.compile(r'(\d+)/?(\d{4})?')
-
-# Extracts team scrape parameters.
-scrapeTeamsRe = re.compile(r'(\d{4})/(\d+)')
+# Separates the events in a list of events.
+eventSeparatorRe = re.compile(r'[\s,]+')
 
 # Extracts the requested manual section.
 sectionRe = re.compile(r'/([iagrt])')
@@ -75,486 +70,802 @@ frcUrl = 'http://www.firstinspires.org/robotics/frc/'
 documentsYears = {'default':'http://www.firstinspires.org/node/5331',
                   defaultYear:frcUrl + 'game-manual-and-qa-system'}
 
-lastScrapeTime = None
-
-# Pre-compute the event list for the instructions page.
-eventList = json.load(open("events.json"))
-events = []
-for i in xrange(0, (len(eventList) + 2) / 3):
-  row = [eventList[i]['code'], eventList[i]['name']]
-  j = i + (len(eventList) + 2) / 3
-  row.append(eventList[j]['code'])
-  row.append(eventList[j]['name'])
-  k = j + (len(eventList) + 2) / 3
-  if k < len(eventList):
-    row.append(eventList[k]['code'])
-    row.append(eventList[k]['name'])
-  events.append(row)
-
-def GetYear(handler):
-  endNumber = yearRe.findall(handler.request.path)
-  if len(endNumber) > 0:
-    return endNumber[-1]
+# Most teams that one /api/teams request may look up, since each uncached team
+# costs datastore work.
+maxApiTeams = 500
+
+# Whether GetTpid may scrape the FIRST website when a team isn't cached. Normally
+# off, since WarmTeamsPage keeps the cached teams up to date in the background.
+scrapeOnMiss = False
+
+# Whether to redirect with an HTTP Location header instead of the client-side
+# redirect page. Destinations that check the referrer always use the latter.
+useHttpRedirects = False
+
+# How long browsers and caches may keep HTTP redirects whose destination never
+# changes, and those that depend on the season or on team data.
+staticRedirectSeconds = 7 * 24 * 3600
+seasonalRedirectSeconds = 3600
+
+# Stands in for the destination URL when pre-rendering the redirect page.
+redirectPlaceholder = 'FRCLINKSREDIRECTURL'
+
+# The redirect page pre-rendered once, split around the places the URL goes, so
+# that each redirect only needs to splice in the escaped destination. Filled in
+# on first use.
+redirectParts = None
+
+# The rendered instructions page and its ETag, filled in on first use.
+instructionsPage = None
+
+# Memoizes the destination URL of each normalized path served by a RedirectPage.
+resolveCache = LruCache(4096)
+
+# Pre-compute the event code lookups. New seasons' aliases, Championship
+# divisions and legacy codes belong in eventcodes.json rather than in code.
+# Divisions and TBA codes are keyed by year, with 'default' covering any year
+# not listed.
+eventCodes = json.load(open("eventcodes.json"))
+eventAliases = eventCodes['aliases']
+divisionParents = {}
+for divisionYear, parents in eventCodes['divisions'].iteritems():
+  divisionParents[divisionYear] = {}
+  for parent, divisions in parents.iteritems():
+    for division in divisions:
+      divisionParents[divisionYear][division] = parent
+tbaEventCodes = eventCodes['tba']
+legacyEventCodes = eventCodes['legacy']
+
+def GetYear(year):
+  if year:
+    return year
   else:
     return defaultYear
 
-def GetEvent(handler):
-  event = eventRe.findall(handler.request.path)[-1]
-
-  if event == 'arc':
-    event = 'archimedes'
-  elif event == 'cars':
-    event = 'carson'
-  elif event == 'carv':
-    event = 'carver'
-  elif event == 'cur':
-    event = 'curie'
-  elif event == 'dal':
-    event = 'daly'
-  elif event == 'dar':
-    event = 'darwin'
-  elif event == 'gal':
-    event = 'galileo'
-  elif event == 'hop':
-    event = 'hopper'
-  elif event == 'new':
-    event = 'newton'
-  elif event == 'roe':
-    event = 'roebling'
-  elif event == 'tes':
-    event = 'tesla'
-  elif event == 'tur':
-    event = 'turing'
-  elif event == 'ein':
-    event = 'einstein'
-
-  return event
-
-def GetTpid(handler):
-    team = numberRe.findall(handler.request.path)[-1]
+def GetEvent(event):
+  return eventAliases.get(event, event)
+
+def GetLegacyEvent(event, year):
+  return legacyEventCodes.get(year, {}).get(event, event)
+
+def GetDivisionParent(event, year):
+  return divisionParents.get(year, divisionParents['default']).get(event)
+
+def GetTbaEvent(event, year):
+  return tbaEventCodes.get(year, tbaEventCodes['default']).get(event, event)
+
+def GetTpid(team):
+    # team.py and the datastore are imported on first use to keep cold starts
+    # fast, since most requests never touch them.
+    from team import AllowScrape, LookupTeam, ScrapeTeamOnce
 
     # Try checking the datastore for the team's most recent tpid.
     tpid = LookupTeam(team)
 
-    global lastScrapeTime
-    if not tpid and (lastScrapeTime is None or time.time() - lastScrapeTime > 3600):
+    if not tpid and scrapeOnMiss and AllowScrape(team):
       # Otherwise, try scraping the FIRST website for the current season's tpid.
-      tpid = ScrapeTeam(team, defaultYear)
-      lastScrapeTime = time.time()
+      try:
+        tpid = ScrapeTeamOnce(team, defaultYear)
+      except UnavailableError:
+        # Treat the team as unknown rather than waiting on an unhealthy FIRST.
+        tpid = None
 
     return tpid
 
-def GetTeamPageUrl(handler):
-    tpid = GetTpid(handler)
+def GetDetails(tpid):
+    # Returns None when FIRST has no such team, or the details aren't cached
+    # and FIRST can't be reached.
+    from team import GetTeamDetails
+    try:
+      return GetTeamDetails(tpid)
+    except UnavailableError:
+      return None
+
+def GetTeamPageUrl(team):
+    tpid = GetTpid(team)
     if tpid:
-      return ('http://www.firstinspires.org/team-event-search/team?id=' + tpid)
+      return TeamPageUrl(tpid)
 
     return None
 
-def Redir(handler, url):
+def TeamPageUrl(tpid):
+    return 'http://www.firstinspires.org/team-event-search/team?id=' + tpid
+
+def RenderRedirect(url):
+  """
+  Returns the body of the client-side redirect page for the given URL. The URL
+  is HTML-escaped for the meta refresh tag and escaped as a string literal for
+  the script.
+  """
+  # Only needed once a redirect page is rendered, so imported on first use.
+  import cgi
+
+  global redirectParts
+  if redirectParts is None:
+    redirectParts = RenderTemplate(
+        'templates/redirect.html',
+        { 'url' : redirectPlaceholder, }).encode('utf-8').split(
+            redirectPlaceholder)
+  url = url.encode('utf-8')
+  htmlUrl = cgi.escape(url, True).replace("'", '&#39;')
+  scriptUrl = (url.replace('\\', '\\\\').replace('"', '\\"')
+               .replace('<', '\\x3c').replace('\n', ''))
+  return (redirectParts[0] + htmlUrl + redirectParts[1] + scriptUrl +
+          redirectParts[2])
+
+@Timed('template.render')
+def RenderTemplate(path, values):
+  """
+  Renders the given template. The template library is imported on first use,
+  since loading it is a large part of an instance's startup time.
+  """
+  from google.appengine.ext.webapp import template
+  return template.render(path, values)
+
+def GetEventGrid():
+  """
+  Returns the events from events.json laid out in three columns for the
+  instructions page, as rows of alternating codes and names.
+  """
+  eventList = json.load(open("events.json"))
+  events = []
+  for i in xrange(0, (len(eventList) + 2) / 3):
+    row = [eventList[i]['code'], eventList[i]['name']]
+    j = i + (len(eventList) + 2) / 3
+    row.append(eventList[j]['code'])
+    row.append(eventList[j]['name'])
+    k = j + (len(eventList) + 2) / 3
+    if k < len(eventList):
+      row.append(eventList[k]['code'])
+      row.append(eventList[k]['name'])
+    events.append(row)
+  return events
+
+def GetInstructionsPage():
+  """
+  Returns the rendered instructions page and its ETag, rendering it only once
+  per instance since its content only changes with a deploy.
+  """
+  global instructionsPage
+  if instructionsPage is None:
+    body = RenderTemplate('templates/instructions.html',
+                           { 'events' : GetEventGrid() }).encode('utf-8')
+    instructionsPage = (body, '"%s"' % hashlib.md5(body).hexdigest())
+  return instructionsPage
+
+def Redir(handler, url, cacheSeconds=seasonalRedirectSeconds, permanent=False):
   if 'my.usfirst.org/myarea' in url:
     # FIRST is now checking the 'Referer' header for the string 'usfirst.org'.
     handler.redirect('/usfirst.org?' + urllib.urlencode({ 'url' : url }))
+  elif useHttpRedirects:
+    # HTTP redirects are off by default, so this is imported on first use.
+    import email.utils
+    handler.redirect(url.encode('utf-8'), permanent=permanent)
+    handler.response.headers['Cache-Control'] = 'public, max-age=%d' % cacheSeconds
+    handler.response.headers['Expires'] = email.utils.formatdate(
+        time.time() + cacheSeconds, usegmt=True)
   else:
-    handler.response.out.write(
-        template.render('templates/redirect.html', { 'url' : url, }))
+    handler.response.out.write(RenderRedirect(url))
+
+class RedirectPage(webapp.RequestHandler):
+  """
+  Base class for handlers whose destination URL depends only on the request
+  path. Subclasses implement a static GetUrl() taking the route's captures.
+  """
+  cacheSeconds = seasonalRedirectSeconds
+  permanent = False
+
+  def get(self, **params):
+    Redir(self, Resolve(self.request.path), self.cacheSeconds, self.permanent)
+
+class StaticRedirectPage(RedirectPage):
+  """
+  Base class for handlers whose destination never changes between seasons, so
+  that HTTP redirects to it can be permanent and cached for longer.
+  """
+  cacheSeconds = staticRedirectSeconds
+  permanent = True
 
 class TeamPage(webapp.RequestHandler):
   """
   Redirects the user to the given team's FIRST information page.
   """
-  def get(self):
-    teamPageUrl = GetTeamPageUrl(self)
+  def get(self, team):
+    teamPageUrl = GetTeamPageUrl(team)
     if teamPageUrl:
       Redir(self, teamPageUrl)
     else:
-      team = numberRe.findall(self.request.path)[-1]
       template_values = {
         'team': team,
       }
       path = 'templates/no_team.html'
-      self.response.out.write(template.render(path, template_values))
+      self.response.out.write(RenderTemplate(path, template_values))
 
-class AreaTeamListPage(webapp.RequestHandler):
+class AreaTeamListPage(RedirectPage):
   """
   Redirects the user to the team list for the given area.
   """
-  def get(self):
-    area = areaRe.findall(self.request.path)[-1]
-    Redir(self, 'https://my.firstinspires.org/myarea/index.lasso?page=searchresults' +
-                  '&programs=FRC&reports=teams&sort_teams=number&results_size' +
-                  '=250&omit_searchform=1&season_FRC=' + GetYear(self) +
-                  '&area=' + area)
+  @staticmethod
+  def GetUrl(area, year=None):
+    return ('https://my.firstinspires.org/myarea/index.lasso?page=searchresults' +
+              '&programs=FRC&reports=teams&sort_teams=number&results_size' +
+              '=250&omit_searchform=1&season_FRC=' + GetYear(year) +
+              '&area=' + area)
 
 class TeamWebsitePage(webapp.RequestHandler):
   """
   Redirects the user to the team website listed on the given team's FIRST
   information page.
   """
-  def get(self):
-    tpid = GetTpid(self)
-    if not tpid:
+  def get(self, team):
+    tpid = GetTpid(team)
+    details = tpid and GetDetails(tpid)
+    if not details:
       template_values = {
         'team': team,
       }
       path = 'templates/no_team.html'
-      self.response.out.write(template.render(path, template_values))
+      self.response.out.write(RenderTemplate(path, template_values))
       return
 
-    teamQueryUrl = ('http://es01.usfirst.org/teams/_search?size=1&source={' +
-        '"query":{"query_string":{"query":"_id:' + tpid + '"}}}')
-
-    teamInfoPage = urlfetch.fetch(teamQueryUrl, deadline=10)
-    teamInfo = json.loads(teamInfoPage.content)
-    website = teamInfo['hits']['hits'][0]['_source']['team_web_url']
-    if not website.startswith("http"):
-      website = 'http://' + website
-    if not website or len(website) == 0:
+    website = details.webUrl
+    if not website:
       template_values = {
         'team': team,
       }
       path = 'templates/no_website.html'
-      self.response.out.write(template.render(path, template_values))
+      self.response.out.write(RenderTemplate(path, template_values))
     else:
+      if not website.startswith("http"):
+        website = 'http://' + website
       Redir(self, website)
 
 class TeamMapPage(webapp.RequestHandler):
   """
   Redirects the user to a Google Map of the team's location.
   """
-  def get(self):
-    tpid = GetTpid(self)
-    if not tpid:
+  def get(self, team):
+    tpid = GetTpid(team)
+    details = tpid and GetDetails(tpid)
+    if not details:
       template_values = {
         'team': team,
       }
       path = 'templates/no_team.html'
-      self.response.out.write(template.render(path, template_values))
+      self.response.out.write(RenderTemplate(path, template_values))
       return
 
-    teamQueryUrl = ('http://es01.usfirst.org/teams/_search?size=1&source={' +
-        '"query":{"query_string":{"query":"_id:' + tpid + '"}}}')
-
-    teamInfoPage = urlfetch.fetch(teamQueryUrl, deadline=10)
-    teamInfo = json.loads(teamInfoPage.content)
-    city = teamInfo['hits']['hits'][0]['_source']['team_city']
-    stateProv = teamInfo['hits']['hits'][0]['_source']['team_stateprov']
-    country = teamInfo['hits']['hits'][0]['_source']['team_country']
-    mapUrl = 'https://www.google.com/maps?q=' + city + '+' + stateProv + '+' + country
-    if country in ['Canada', 'USA', 'United Kingdom']:
-      postalCode = teamInfo['hits']['hits'][0]['_source']['team_postalcode']
-      mapUrl += '+' + postalCode
-    Redir(self, mapUrl)
+    # Details stored before missing fields were defaulted may hold None.
+    location = [details.city, details.stateProv, details.country]
+    if details.country in ['Canada', 'USA', 'United Kingdom']:
+      location.append(details.postalCode)
+    Redir(self, 'https://www.google.com/maps?q=' +
+                '+'.join([part for part in location if part]))
 
-class TeamTheBlueAlliancePage(webapp.RequestHandler):
+class TeamTheBlueAlliancePage(RedirectPage):
   """
   Redirects the user to the given team's The Blue Alliance page.
   """
-  def get(self):
-    team, year = blueAllianceRe.findall(self.request.path)[-1]
-    if len(year) == 0:
-      year = defaultYear
-    Redir(self, 'https://www.thebluealliance.com/team/%s/%s' % (team, year))
+  @staticmethod
+  def GetUrl(team, year=None):
+    year = GetYear(year)
+    return 'https://www.thebluealliance.com/team/%s/%s' % (team, year)
 
-class TheBlueAlliancePage(webapp.RequestHandler):
+class TheBlueAlliancePage(StaticRedirectPage):
   """
   Redirects the user to the The Blue Alliance homepage.
   """
-  def get(self):
-    Redir(self, 'https://www.thebluealliance.com')
+  @staticmethod
+  def GetUrl():
+    return 'https://www.thebluealliance.com'
 
-class TeamChiefDelphiMediaPage(webapp.RequestHandler):
+class TeamChiefDelphiMediaPage(StaticRedirectPage):
   """
   Redirects the user to the given team's Chief Delphi Media page.
   """
-  def get(self):
-    team = numberRe.findall(self.request.path)[-1]
-    Redir(self, 'http://www.chiefdelphi.com/media/photos/tags/frc' + team)
+  @staticmethod
+  def GetUrl(team):
+    return 'http://www.chiefdelphi.com/media/photos/tags/frc' + team
 
-class AllTeamsPage(webapp.RequestHandler):
+class AllTeamsPage(RedirectPage):
   """
   Redirects the user to the list of all registered FRC teams.
   """
-  def get(self):
-    Redir(self, 'https://my.firstinspires.org/myarea/index.lasso?page=searchresults' +
-                  '&programs=FRC&reports=teams&sort_teams=number&results_size' +
-                  '=250&omit_searchform=1&season_FRC=' + defaultYear)
+  @staticmethod
+  def GetUrl():
+    return ('https://my.firstinspires.org/myarea/index.lasso?page=searchresults' +
+              '&programs=FRC&reports=teams&sort_teams=number&results_size' +
+              '=250&omit_searchform=1&season_FRC=' + defaultYear)
 
-class EventTeamListPage(webapp.RequestHandler):
+class EventTeamListPage(RedirectPage):
   """
   Redirects the user to the team list for the given event.
   """
-  def get(self):
-    event = GetEvent(self)
-    year = GetYear(self)
+  @staticmethod
+  def GetUrl(event, year=None):
+    event = GetEvent(event)
+    year = GetYear(year)
 
-    if event in ['carver', 'galileo', 'hopper', 'newton', 'roebling', 'turing']:
-      event = 'cmptx&division=' + event
-    elif event in ['archimedes', 'carson', 'curie', 'daly', 'darwin', 'tesla']:
-      event = 'cmpmo&division=' + event
+    parent = GetDivisionParent(event, year)
+    if parent:
+      event = parent + '&division=' + event
 
-    Redir(self, 'https://my.firstinspires.org/myarea/index.lasso?' +
-                  'page=teamlist&event_type=FRC&sort_teams=number' +
-                  '&year=' + year +
-                  '&event=' + event)
+    return ('https://my.firstinspires.org/myarea/index.lasso?' +
+              'page=teamlist&event_type=FRC&sort_teams=number' +
+              '&year=' + year +
+              '&event=' + event)
 
-class EventSchedulePage(webapp.RequestHandler):
+class EventSchedulePage(RedirectPage):
   """
   Redirects the user to the qualification match schedule for the given event.
   """
-  def get(self):
-    event = GetEvent(self)
-    year = GetYear(self)
+  @staticmethod
+  def GetUrl(event, year=None):
+    event = GetEvent(event)
+    year = GetYear(year)
 
     if int(year) >= 2006:
-      Redir(self, 'http://frc-events.firstinspires.org/' + year + '/' + event +
-                    '/qualifications')
+      return ('http://frc-events.firstinspires.org/' + year + '/' + event +
+                '/qualifications')
     else:
-      Redir(self, 'http://www2.usfirst.org/' + year + 'comp/Events/' +
-                    event + '/ScheduleQual.html')
+      return ('http://www2.usfirst.org/' + year + 'comp/Events/' +
+                event + '/ScheduleQual.html')
 
-class EventMatchResultsPage(webapp.RequestHandler):
+class EventMatchResultsPage(RedirectPage):
   """
   Redirects the user to the qualification match results for the given event.
   """
-  def get(self):
-    year = GetYear(self)
-    event = GetEvent(self)
+  @staticmethod
+  def GetUrl(event, year=None):
+    year = GetYear(year)
+    event = GetEvent(event)
 
     # In 2005, 2006 and 2008 the code "einstein" was used instead of "cmp".
-    if event == 'cmp':
-      if year == '2005' or year == '2006' or year == '2008':
-        event = 'einstein'
+    event = GetLegacyEvent(event, year)
 
     if int(year) >= 2006:
-      Redir(self, 'http://frc-events.firstinspires.org/' + year + '/' + event +
-                    '/qualifications')
+      return ('http://frc-events.firstinspires.org/' + year + '/' + event +
+                '/qualifications')
     elif (year == '2004'):
-      Redir(self, 'http://www2.usfirst.org/' + year + 'comp/Events/' + event
-                    + '/matches.html')
+      return ('http://www2.usfirst.org/' + year + 'comp/Events/' + event
+                + '/matches.html')
     elif year == '2003':
-      Redir(self, 'http://www2.usfirst.org/' + year + 'comp/Events/' + event
-                    + '/matchsum.html')
+      return ('http://www2.usfirst.org/' + year + 'comp/Events/' + event
+                + '/matchsum.html')
     else:
-      Redir(self, 'http://www2.usfirst.org/' + year + 'comp/Events/' + event
-                    + '/matchresults.html')
+      return ('http://www2.usfirst.org/' + year + 'comp/Events/' + event
+                + '/matchresults.html')
 
-class EventRankingsPage(webapp.RequestHandler):
+class EventRankingsPage(RedirectPage):
   """
   Redirects the user to the rankings for the given event.
   """
-  def get(self):
-    event = GetEvent(self)
-    year = GetYear(self)
+  @staticmethod
+  def GetUrl(event, year=None):
+    event = GetEvent(event)
+    year = GetYear(year)
 
     if int(year) >= 2006:
-      Redir(self, 'http://frc-events.firstinspires.org/' + year + '/' + event +
-                    '/rankings')
+      return ('http://frc-events.firstinspires.org/' + year + '/' + event +
+                '/rankings')
     else:
-      Redir(self, 'http://www2.usfirst.org/' + GetYear(self) + 'comp/Events/' +
-                    GetEvent(self) + '/rankings.html')
+      return ('http://www2.usfirst.org/' + year + 'comp/Events/' +
+                event + '/rankings.html')
 
-class EventAwardsPage(webapp.RequestHandler):
+class EventAwardsPage(RedirectPage):
   """
   Redirects the user to the awards for the given event.
   """
-  def get(self):
-    year = GetYear(self)
-    event = GetEvent(self)
+  @staticmethod
+  def GetUrl(event, year=None):
+    year = GetYear(year)
+    event = GetEvent(event)
 
     # In 2005, 2006 and 2008 the code "einstein" was used instead of "cmp".
-    if event == 'cmp':
-      if year == '2005' or year == '2006' or year == '2008':
-        event = 'einstein'
+    event = GetLegacyEvent(event, year)
 
     if int(year) >= 2006:
-      Redir(self, 'http://frc-events.firstinspires.org/' + year + '/' + event +
-                    '/awards')
+      return ('http://frc-events.firstinspires.org/' + year + '/' + event +
+                '/awards')
     else:
-      Redir(self, 'http://www2.usfirst.org/' + year + 'comp/Events/' + event
-                    + '/awards.html')
+      return ('http://www2.usfirst.org/' + year + 'comp/Events/' + event
+                + '/awards.html')
 
-class EventAgendaPage(webapp.RequestHandler):
+class EventAgendaPage(RedirectPage):
   """
   Redirects the user to the public agenda for the given event.
   """
-  def get(self):
-    year = GetYear(self)
-    event = GetEvent(self)
+  @staticmethod
+  def GetUrl(event, year=None):
+    year = GetYear(year)
+    event = GetEvent(event)
 
-    Redir(self, 'http://www.firstinspires.org/sites/default/files/uploads/frc/'
-                  + '/%s-events/%s_%s_Agenda.pdf' % (year, year, event.upper()))
+    return ('http://www.firstinspires.org/sites/default/files/uploads/frc/'
+              + '/%s-events/%s_%s_Agenda.pdf' % (year, year, event.upper()))
 
-class EventTheBlueAlliancePage(webapp.RequestHandler):
+class EventTheBlueAlliancePage(RedirectPage):
   """
   Redirects the user to the The Blue Alliance page for the given event.
   """
-  def get(self):
-    event = GetEvent(self)
-    if event in ['archimedes', 'curie', 'daly', 'darwin', 'galileo', 'hopper',
-        'newton', 'roebling', 'tesla', 'turing']:
-      event = event[:3]
-    elif event in ['carson', 'carver']:
-      event = event[:4]
-    Redir(self, 'https://www.thebluealliance.com/event/' + GetYear(self) + event)
+  @staticmethod
+  def GetUrl(event, year=None):
+    year = GetYear(year)
+    event = GetTbaEvent(GetEvent(event), year)
+    return 'https://www.thebluealliance.com/event/' + year + event
 
-class RegionalsPage(webapp.RequestHandler):
+class RegionalsPage(RedirectPage):
   """
   Redirects the user to the Regional Events page.
   """
-  def get(self):
+  @staticmethod
+  def GetUrl():
     # TODO: Replace with an official page if one ever manifests.
-    Redir(self, 'https://frc-events.firstinspires.org/{0}/events'.format(defaultYear))
+    return 'https://frc-events.firstinspires.org/{0}/events'.format(defaultYear)
 
-class ChampionshipPage(webapp.RequestHandler):
+class ChampionshipPage(StaticRedirectPage):
   """
   Redirects the user to the Championship Event page.
   """
-  def get(self):
-    Redir(self, 'http://firstchampionship.org')
+  @staticmethod
+  def GetUrl():
+    return 'http://firstchampionship.org'
 
-class DistrictRankingsPage(webapp.RequestHandler):
+class DistrictRankingsPage(RedirectPage):
   """
   Redirects the user to the rankings page for the given district.
   """
-  def get(self):
-    district = GetEvent(self)
-    Redir(self, 'http://frc-districtrankings.firstinspires.org/' + defaultYear + '/' + district)
+  @staticmethod
+  def GetUrl(district):
+    district = GetEvent(district)
+    return 'http://frc-districtrankings.firstinspires.org/' + defaultYear + '/' + district
 
-class DocumentsPage(webapp.RequestHandler):
+class DocumentsPage(RedirectPage):
   """
   Redirects the user to the Competition Manual page.
   """
-  def get(self):
-    year = GetYear(self)
+  @staticmethod
+  def GetUrl(year=None):
+    year = GetYear(year)
     if documentsYears.has_key(year):
-      Redir(self, documentsYears.get(year))
+      return documentsYears.get(year)
     else:
-      Redir(self, documentsYears.get('default'))
+      return documentsYears.get('default')
 
-class KitOfPartsPage(webapp.RequestHandler):
+class KitOfPartsPage(StaticRedirectPage):
   """
   Redirects the user to the Kit of Parts page.
   """
-  def get(self):
-    Redir(self, frcUrl + 'kit-of-parts')
+  @staticmethod
+  def GetUrl():
+    return frcUrl + 'kit-of-parts'
 
-class UpdatesPage(webapp.RequestHandler):
+class UpdatesPage(RedirectPage):
   """
   Redirects the user to the Team Updates page.
   """
-  def get(self):
-    year = GetYear(self)
+  @staticmethod
+  def GetUrl(year=None):
+    year = GetYear(year)
     if documentsYears.has_key(year):
-      Redir(self, documentsYears.get(year))
+      return documentsYears.get(year)
     else:
-      Redir(self, documentsYears.get('default'))
+      return documentsYears.get('default')
 
-class BlogPage(webapp.RequestHandler):
+class BlogPage(StaticRedirectPage):
   """
   Redirects the user to the FRC Blog.
   """
-  def get(self):
-    Redir(self, frcUrl + 'blog')
+  @staticmethod
+  def GetUrl():
+    return frcUrl + 'blog'
 
-class ForumsPage(webapp.RequestHandler):
+class ForumsPage(StaticRedirectPage):
   """
   Redirects the user to the FIRST forums.
   """
-  def get(self):
-    Redir(self, 'http://forums.usfirst.org')
+  @staticmethod
+  def GetUrl():
+    return 'http://forums.usfirst.org'
 
-class QAPage(webapp.RequestHandler):
+class QAPage(StaticRedirectPage):
   """
   Redirects the user to the Q&A forum.
   """
-  def get(self):
-    Redir(self, 'https://frc-qa.firstinspires.org')
+  @staticmethod
+  def GetUrl():
+    return 'https://frc-qa.firstinspires.org'
 
-class NewsPage(webapp.RequestHandler):
+class NewsPage(StaticRedirectPage):
   """
   Redirects the user to the FRC news page.
   """
-  def get(self):
-    Redir(self, 'http://www.firstinspires.org/node/4341')
+  @staticmethod
+  def GetUrl():
+    return 'http://www.firstinspires.org/node/4341'
 
-class YouTubePage(webapp.RequestHandler):
+class YouTubePage(StaticRedirectPage):
   """
   Redirects the user to the FRC YouTube channel.
   """
-  def get(self):
-    Redir(self, 'http://www.youtube.com/user/FRCTeamsGlobal')
+  @staticmethod
+  def GetUrl():
+    return 'http://www.youtube.com/user/FRCTeamsGlobal'
 
-class TIMSPage(webapp.RequestHandler):
+class TIMSPage(StaticRedirectPage):
   """
   Redirects the user to the FRC Team Information Management System (TIMS).
   """
-  def get(self):
-    Redir(self, 'https://my.firstinspires.org/frc/tims/site.lasso')
+  @staticmethod
+  def GetUrl():
+    return 'https://my.firstinspires.org/frc/tims/site.lasso'
 
-class STIMSPage(webapp.RequestHandler):
+class STIMSPage(StaticRedirectPage):
   """
   Redirects the user to the Student Team Information Member System (TIMS).
   """
-  def get(self):
-    Redir(self, 'https://my.firstinspires.org/stims/site.lasso')
+  @staticmethod
+  def GetUrl():
+    return 'https://my.firstinspires.org/stims/site.lasso'
 
-class VIMSPage(webapp.RequestHandler):
+class VIMSPage(StaticRedirectPage):
   """
   Redirects the user to the Volunteer Information & Matching System (VIMS).
   """
-  def get(self):
-    Redir(self, 'https://my.firstinspires.org/FIRSTPortal/Login/VIMS_Login.aspx')
+  @staticmethod
+  def GetUrl():
+    return 'https://my.firstinspires.org/FIRSTPortal/Login/VIMS_Login.aspx'
 
-class KickoffPage(webapp.RequestHandler):
+class KickoffPage(StaticRedirectPage):
   """
   Redirects the user to the FRC Kickoff Page from FIRST
   """
-  def get(self):
-    Redir(self, frcUrl + 'kickoff')
+  @staticmethod
+  def GetUrl():
+    return frcUrl + 'kickoff'
 
-class CalendarPage(webapp.RequestHandler):
+class CalendarPage(StaticRedirectPage):
   """
   Redirects the user to the FRC Calendar of Events.
   """
-  def get(self):
-    Redir(self, 'http://www.firstinspires.org/robotics/frc/calendar')
+  @staticmethod
+  def GetUrl():
+    return 'http://www.firstinspires.org/robotics/frc/calendar'
 
-class CookiePage(webapp.RequestHandler):
+class CookiePage(StaticRedirectPage):
   """
   ???
   """
-  def get(self):
-    Redir(self, 'http://www.chiefdelphi.com/media/photos/33801')
+  @staticmethod
+  def GetUrl():
+    return 'http://www.chiefdelphi.com/media/photos/33801'
+
+def WriteTaskStatus(handler, done):
+  """
+  Tells the admin running a task page whether the task finished or a task was
+  queued to continue it.
+  """
+  handler.response.headers['Content-Type'] = 'text/plain'
+  if done:
+    handler.response.out.write('Done.\n')
+  else:
+    handler.response.out.write('Out of time; queued a task to continue.\n')
 
 class FlushTeamsPage(webapp.RequestHandler):
   """
-  Deletes 500 teams at a time from the datastore (Google limit).
-  Unlisted on the instructions page; intended for admin use.
+  Deletes all teams from the datastore, queueing a task to continue if it runs
+  out of time, and reports whether it finished. Admin only.
   """
   def get(self):
-    FlushTeams()
-    path = 'templates/instructions.html'
-    self.response.out.write(template.render(path, {}))
+    from google.appengine.api import taskqueue
+    from team import FlushTeams
+    done = FlushTeams()
+    if not done:
+      taskqueue.add(url='/tasks/flushteams', method='GET')
+    WriteTaskStatus(self, done)
 
 class ScrapeTeamsPage(webapp.RequestHandler):
   """
   Retrieves and caches teams from the given year in the datastore.
   Unlisted on the instructions page; intended for admin use.
   """
-  def get(self):
-    scrapeTeamsMatch = scrapeTeamsRe.findall(self.request.path)
-    ScrapeTeams(scrapeTeamsMatch[-1][0], scrapeTeamsMatch[-1][1])
+  def get(self, year, start):
+    from team import ScrapeTeams
+    ScrapeTeams(year, start)
     path = 'templates/instructions.html'
-    self.response.out.write(template.render(path, {}))
+    self.response.out.write(RenderTemplate(path, {}))
+
+class WarmTeamsPage(webapp.RequestHandler):
+  """
+  Refreshes the cached teams for the current season in the background, queueing
+  a task to continue if it runs out of time. Once a pass is done, queues the
+  migration if the known teams aren't complete yet, as after a fresh deploy or a
+  flush, so that unknown team numbers start being rejected. Run by cron; admin
+  only.
+  """
+  def get(self):
+    from google.appengine.api import taskqueue
+    from team import LoadKnownTeams, WarmTeams
+    if not WarmTeams(defaultYear):
+      taskqueue.add(url='/tasks/warmteams', method='GET')
+    elif not LoadKnownTeams()[1]:
+      taskqueue.add(url='/tasks/migrateteams', method='GET')
+
+class ScrapeRostersPage(webapp.RequestHandler):
+  """
+  Caches the team list of every event in events.json for the current season,
+  queueing a task to continue if it runs out of time. Run by cron; admin only.
+  """
+  def get(self):
+    from google.appengine.api import taskqueue
+    from roster import ScrapeRosters
+    events = [GetEvent(event['code'].lower())
+              for event in json.load(open("events.json"))]
+    if not ScrapeRosters(defaultYear, events, EventTeamListPage.GetUrl):
+      taskqueue.add(url='/tasks/rosters', method='GET')
+
+class RefreshTeamDetailsPage(webapp.RequestHandler):
+  """
+  Re-fetches the cached details of the team with the given tpid. Queued when
+  stale details are served; admin only.
+  """
+  def get(self, tpid):
+    from team import FetchTeamDetails
+    FetchTeamDetails(tpid)
+
+class PrefetchTeamsPage(webapp.RequestHandler):
+  """
+  Caches the details of every team at the given event, or of the teams listed
+  in the 'teams' parameter, ahead of time. Unlisted on the instructions page;
+  intended for admin use.
+  """
+  def get(self, event=None, year=None):
+    from team import FetchEventTeams, PrefetchTeamDetails
+    if event:
+      numbers = FetchEventTeams(EventTeamListPage.GetUrl(event, year))
+    else:
+      numbers = numberRe.findall(self.request.get('teams'))
+    queriesSaved = PrefetchTeamDetails(numbers)
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('Prefetched %d teams, saving %d queries.' %
+                            (len(numbers), queriesSaved))
+
+class ExportTeamsPage(webapp.RequestHandler):
+  """
+  Downloads a snapshot of every team in the datastore. Save it as teams.bin
+  before deploying so that new instances can look up teams without any RPCs.
+  Admin only.
+  """
+  def get(self):
+    from team import ExportTeamSnapshot
+    self.response.headers['Content-Type'] = 'application/octet-stream'
+    self.response.out.write(ExportTeamSnapshot())
+
+class MigrateTeamsPage(webapp.RequestHandler):
+  """
+  Re-keys teams in the datastore by team number and completes the known teams,
+  queueing a task to continue if it runs out of time, and reports whether it
+  finished. Admin only.
+  """
+  def get(self):
+    from google.appengine.api import taskqueue
+    from team import MigrateTeams
+    done = MigrateTeams()
+    if not done:
+      taskqueue.add(url='/tasks/migrateteams', method='GET')
+    WriteTaskStatus(self, done)
+
+# The pages whose destinations make up an event's links, with the link names.
+eventLinkPages = [
+  ('teams', EventTeamListPage),
+  ('schedule', EventSchedulePage),
+  ('matchresults', EventMatchResultsPage),
+  ('rankings', EventRankingsPage),
+  ('awards', EventAwardsPage),
+  ('agenda', EventAgendaPage),
+  ('tba', EventTheBlueAlliancePage),
+]
+
+def GetEventLinks(event, year=None):
+  return dict((name, page.GetUrl(event, year))
+              for name, page in eventLinkPages)
+
+class EventLinksApiPage(webapp.RequestHandler):
+  """
+  Returns every link for the given event as a JSON object keyed by link name.
+  Without an event, returns the links for each event listed in the 'e'
+  parameter (as code or code/year, separated by commas or spaces) keyed as
+  listed, with null for entries that aren't event codes.
+  """
+  def get(self, event=None, year=None):
+    if event:
+      links = GetEventLinks(event, year)
+    else:
+      links = {}
+      for entry in eventSeparatorRe.split(self.request.get('e')):
+        if entry:
+          match = eventRe.match(entry)
+          links[entry] = match and GetEventLinks(**match.groupdict())
+    body = json.dumps(links, sort_keys=True)
+    etag = '"%s"' % hashlib.md5(body).hexdigest()
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.headers['Cache-Control'] = ('public, max-age=%d' %
+                                              seasonalRedirectSeconds)
+    self.response.headers['ETag'] = etag
+    if self.request.headers.get('If-None-Match') == etag:
+      self.response.set_status(304)
+      return
+    self.response.out.write(body)
+
+class TeamsApiPage(webapp.RequestHandler):
+  """
+  Returns the FIRST information page URL of each team listed in the 'n'
+  parameter as a JSON object keyed by team number, with null for teams that
+  weren't found. Answers 400 if more than maxApiTeams teams are listed.
+  """
+  def get(self):
+    from team import LookupTeams
+    numbers = numberRe.findall(self.request.get('n'))
+    if len(numbers) > maxApiTeams:
+      self.response.set_status(400)
+      self.response.headers['Content-Type'] = 'text/plain'
+      self.response.out.write('At most %d teams may be looked up at once.\n' %
+                              maxApiTeams)
+      return
+    tpids = LookupTeams(numbers)
+    teamPageUrls = {}
+    for number, tpid in tpids.iteritems():
+      teamPageUrls[number] = tpid and TeamPageUrl(tpid)
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps(teamPageUrls))
+
+class EventRosterApiPage(webapp.RequestHandler):
+  """
+  Returns the numbers of the teams registered for the given event as a JSON
+  list, or null if its roster hasn't been cached.
+  """
+  def get(self, event, year=None):
+    from roster import GetEventRoster
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps(
+        GetEventRoster(GetEvent(event.lower()), GetYear(year))))
+
+class TeamEventsApiPage(webapp.RequestHandler):
+  """
+  Returns the codes of the events that the given team is registered for as a
+  JSON list, as far as the cached rosters show.
+  """
+  def get(self, team, year=None):
+    from roster import GetTeamEvents
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps(GetTeamEvents(team, GetYear(year))))
+
+class StatsPage(webapp.RequestHandler):
+  """
+  Returns the request, lookup and cache stats recorded on this instance as JSON.
+  Unlisted on the instructions page; admin only.
+  """
+  def get(self):
+    from team import GetLookupStats, scrapeStats
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps({
+      'routes': GetStats(),
+      'lookups': GetLookupStats(),
+      'scrapes': scrapeStats,
+      'resolveCache': {'hits': resolveCache.hits,
+                       'misses': resolveCache.misses},
+    }, indent=2, sort_keys=True))
 
 class InstructionPage(webapp.RequestHandler):
   """
   Displays the complete list of commands for this application.
   """
   def get(self):
-    path = 'templates/instructions.html'
-    self.response.out.write(template.render(path, { 'events' : events }))
+    body, etag = GetInstructionsPage()
+    self.response.headers['ETag'] = etag
+    if self.request.headers.get('If-None-Match') == etag:
+      self.response.set_status(304)
+      return
+    self.response.out.write(body)
 
 class RobotsTxtPage(webapp.RequestHandler):
   """
@@ -564,20 +875,20 @@ class RobotsTxtPage(webapp.RequestHandler):
     self.response.headers.add_header('content-type', 'text/plain')
     self.response.out.write('User-agent: *\nDisallow: /')
 
-class GetFRCSpyDump(webapp.RequestHandler):
+class GetFRCSpyDump(StaticRedirectPage):
   """
   Gets the latest CSV dump from Chief Delphi FRC-Spy (Twitter @FRCFMS data)
   """
-  def get(self):
-    Redir(self, 'http://www.chiefdelphi.com/forums/frcspy.php?xml=csv')
+  @staticmethod
+  def GetUrl():
+    return 'http://www.chiefdelphi.com/forums/frcspy.php?xml=csv'
 
 class ReferrerRedirectPage(webapp.RequestHandler):
   """
   Redirects to fool FIRST's referrer-based checking.
   """
   def get(self):
-    self.response.out.write(template.render(
-        'templates/redirect.html', { 'url' : self.request.get('url'), }))
+    self.response.out.write(RenderRedirect(self.request.get('url')))
 
 class BlacklistMiddleware(object):
   def __init__(self, app):
@@ -597,102 +908,174 @@ class NewFrcLinksRedirectPage(webapp.RequestHandler):
   def get(self):
     self.redirect("http://frc.link" + self.request.path)
 
-# The mapping of URLs to handlers. For some reason, regular expressions that
-# use parentheses (e.g. '(championship|cmp|c)') cause an error, so some
-# duplication exists.
-application = webapp.WSGIApplication([
-    # (r'/(?i)teams?/\d+/?', TeamPage),
-    # (r'/(?i)t/\d+/?', TeamPage),
-    # (r'/(?i)teams?/[A-Za-z\-]+/\d{4}/?', AreaTeamListPage),
-    # (r'/(?i)teams?/[A-Za-z\-]+/?', AreaTeamListPage),
-    # (r'/(?i)t/[A-Za-z\-]+/\d{4}/?', AreaTeamListPage),
-    # (r'/(?i)t/[A-Za-z\-]+/?', AreaTeamListPage),
-    # (r'/(?i)t/\d+/?', TeamPage),
-    # (r'/(?i)website/\d+/?', TeamWebsitePage),
-    # (r'/(?i)w/\d+/?', TeamWebsitePage),
-    # (r'/(?i)map/\d+/?', TeamMapPage),
-    # (r'/(?i)m/\d+/?', TeamMapPage),
-    # (r'/(?i)tba/\d+/\d{4}/?', TeamTheBlueAlliancePage),
-    # (r'/(?i)tba/\d+/?', TeamTheBlueAlliancePage),
-    # (r'/(?i)tba/?', TheBlueAlliancePage),
-    # (r'/(?i)cdm/\d+/?', TeamChiefDelphiMediaPage),
-    # (r'/(?i)teams?/?', AllTeamsPage),
-    # (r'/(?i)t/?', AllTeamsPage),
-    # (r'/(?i)events?/schedule/[A-Za-z]+\d?/\d{4}/?', EventSchedulePage),
-    # (r'/(?i)events?/schedule/[A-Za-z]+\d?/?', EventSchedulePage),
-    # (r'/(?i)e/s/[A-Za-z]+\d?/\d{4}/?', EventSchedulePage),
-    # (r'/(?i)e/s/[A-Za-z]+\d?/?', EventSchedulePage),
-    # (r'/(?i)events?/matchresults/[A-Za-z]+\d?/\d{4}/?', EventMatchResultsPage),
-    # (r'/(?i)events?/matchresults/[A-Za-z]+\d?/?', EventMatchResultsPage),
-    # (r'/(?i)e/m/[A-Za-z]+\d?/\d{4}/?', EventMatchResultsPage),
-    # (r'/(?i)e/m/[A-Za-z]+\d?/?', EventMatchResultsPage),
-    # (r'/(?i)events?/rankings/[A-Za-z]+\d?/\d{4}/?', EventRankingsPage),
-    # (r'/(?i)events?/rankings/[A-Za-z]+\d?/?', EventRankingsPage),
-    # (r'/(?i)e/r/[A-Za-z]+\d?/\d{4}/?', EventRankingsPage),
-    # (r'/(?i)e/r/[A-Za-z]+\d?/?', EventRankingsPage),
-    # (r'/(?i)events?/awards/[A-Za-z]+\d?/\d{4}/?', EventAwardsPage),
-    # (r'/(?i)events?/awards/[A-Za-z]+\d?/?', EventAwardsPage),
-    # (r'/(?i)e/a/[A-Za-z]+\d?/\d{4}/?', EventAwardsPage),
-    # (r'/(?i)e/a/[A-Za-z]+\d?/?', EventAwardsPage),
-    # (r'/(?i)events?/agenda/[A-Za-z]+\d?/\d{4}/?', EventAgendaPage),
-    # (r'/(?i)events?/agenda/[A-Za-z]+\d?/?', EventAgendaPage),
-    # (r'/(?i)e/g/[A-Za-z]+\d?/\d{4}/?', EventAgendaPage),
-    # (r'/(?i)e/g/[A-Za-z]+\d?/?', EventAgendaPage),
-    # (r'/(?i)events?/tba/[A-Za-z]+\d?/\d{4}/?', EventTheBlueAlliancePage),
-    # (r'/(?i)events?/tba/[A-Za-z]+\d?/?', EventTheBlueAlliancePage),
-    # (r'/(?i)e/tba/[A-Za-z]+\d?/\d{4}/?', EventTheBlueAlliancePage),
-    # (r'/(?i)e/tba/[A-Za-z]+\d?/?', EventTheBlueAlliancePage),
-    # (r'/(?i)events?/[A-Za-z]+\d?/\d{4}/?', EventTeamListPage),
-    # (r'/(?i)events?/[A-Za-z]+\d?/?', EventTeamListPage),
-    # (r'/(?i)e/[A-Za-z]+\d?/\d{4}/?', EventTeamListPage),
-    # (r'/(?i)e/[A-Za-z]+\d?/?', EventTeamListPage),
-    # (r'/(?i)regionals/\d{4}/?', RegionalsPage),
-    # (r'/(?i)regionals/?', RegionalsPage),
-    # (r'/(?i)r/\d{4}/?', RegionalsPage),
-    # (r'/(?i)r/?', RegionalsPage),
-    # (r'/(?i)championship/\d{4}/?', ChampionshipPage),
-    # (r'/(?i)championship/?', ChampionshipPage),
-    # (r'/(?i)cmp/\d{4}/?', ChampionshipPage),
-    # (r'/(?i)cmp/?', ChampionshipPage),
-    # (r'/(?i)c/\d{4}/?', ChampionshipPage),
-    # (r'/(?i)c/?', ChampionshipPage),
-    # (r'/(?i)districtrankings/[A-Za-z]+/?', DistrictRankingsPage),
-    # (r'/(?i)dr/[A-Za-z]+/?', DistrictRankingsPage),
-    # (r'/(?i)documents/?', DocumentsPage),
-    # (r'/(?i)docs/\d{4}/?', DocumentsPage),
-    # (r'/(?i)docs/?', DocumentsPage),
-    # (r'/(?i)d/\d{4}/?', DocumentsPage),
-    # (r'/(?i)d/?', DocumentsPage),
-    # (r'/(?i)kitofparts/?', KitOfPartsPage),
-    # (r'/(?i)k/?', KitOfPartsPage),
-    # (r'/(?i)updates/?', UpdatesPage),
-    # (r'/(?i)u/?', UpdatesPage),
-    # (r'/(?i)blog/?', BlogPage),
-    # (r'/(?i)b/?', BlogPage),
-    # (r'/(?i)forums?/?', ForumsPage),
-    # (r'/(?i)f/?', ForumsPage),
-    # (r'/(?i)qa?/?', QAPage),
-    # (r'/(?i)news/?', NewsPage),
-    # (r'/(?i)n/?', NewsPage),
-    # (r'/(?i)youtube/?', YouTubePage),
-    # (r'/(?i)y/?', YouTubePage),
-    # (r'/(?i)tims/?', TIMSPage),
-    # (r'/(?i)stims/?', STIMSPage),
-    # (r'/(?i)vims/?', VIMSPage),
-    # (r'/(?i)kickoff/?', KickoffPage),
-    # (r'/(?i)fmsdump/?', GetFRCSpyDump),
-    # (r'/(?i)ko/?', KickoffPage),
-    # (r'/(?i)calendar/?', CalendarPage),
-    # (r'/(?i)cal/?', CalendarPage),
-    # (r'/(?i)cookie/?', CookiePage),
-    # (r'/(?i)flushteams/?', FlushTeamsPage),
-    # (r'/(?i)scrapeteams/\d{4}/\d+/?', ScrapeTeamsPage),
-    # (r'/(?i)robots.txt', RobotsTxtPage),
-    # (r'/(?i)usfirst.org', ReferrerRedirectPage),
-    # ('.*', InstructionPage),
+# The mapping of URLs to handlers, keyed by the first segment of the path. Each
+# pattern must match the remainder of the path (after the first segment, with an
+# optional trailing slash), and its named groups are passed as keyword arguments
+# to the handler's get(). Patterns registered under the same segment are tried in
+# order.
+routes = [
+    (('team', 'teams', 't'), r'(?P<team>\d+)', TeamPage),
+    (('team', 'teams', 't'), r'(?P<area>[A-Za-z\-]+)(?:/(?P<year>\d{4}))?',
+     AreaTeamListPage),
+    (('team', 'teams', 't'), r'', AllTeamsPage),
+    (('website', 'w'), r'(?P<team>\d+)', TeamWebsitePage),
+    (('map', 'm'), r'(?P<team>\d+)', TeamMapPage),
+    (('tba',), r'(?P<team>\d+)(?:/(?P<year>\d{4}))?', TeamTheBlueAlliancePage),
+    (('tba',), r'', TheBlueAlliancePage),
+    (('cdm',), r'(?P<team>\d+)', TeamChiefDelphiMediaPage),
+    (('event', 'events'), r'schedule/' + eventPattern, EventSchedulePage),
+    (('event', 'events'), r'matchresults/' + eventPattern, EventMatchResultsPage),
+    (('event', 'events'), r'rankings/' + eventPattern, EventRankingsPage),
+    (('event', 'events'), r'awards/' + eventPattern, EventAwardsPage),
+    (('event', 'events'), r'agenda/' + eventPattern, EventAgendaPage),
+    (('event', 'events'), r'tba/' + eventPattern, EventTheBlueAlliancePage),
+    (('event', 'events', 'e'), eventPattern, EventTeamListPage),
+    (('e',), r's/' + eventPattern, EventSchedulePage),
+    (('e',), r'm/' + eventPattern, EventMatchResultsPage),
+    (('e',), r'r/' + eventPattern, EventRankingsPage),
+    (('e',), r'a/' + eventPattern, EventAwardsPage),
+    (('e',), r'g/' + eventPattern, EventAgendaPage),
+    (('e',), r'tba/' + eventPattern, EventTheBlueAlliancePage),
+    (('regionals', 'r'), r'(?:\d{4})?', RegionalsPage),
+    (('championship', 'cmp', 'c'), r'(?:\d{4})?', ChampionshipPage),
+    (('districtrankings', 'dr'), r'(?P<district>[A-Za-z]+)', DistrictRankingsPage),
+    (('documents',), r'', DocumentsPage),
+    (('docs', 'd'), r'(?P<year>\d{4})?', DocumentsPage),
+    (('kitofparts', 'k'), r'', KitOfPartsPage),
+    (('updates', 'u'), r'', UpdatesPage),
+    (('blog', 'b'), r'', BlogPage),
+    (('forum', 'forums', 'f'), r'', ForumsPage),
+    (('q', 'qa'), r'', QAPage),
+    (('news', 'n'), r'', NewsPage),
+    (('youtube', 'y'), r'', YouTubePage),
+    (('tims',), r'', TIMSPage),
+    (('stims',), r'', STIMSPage),
+    (('vims',), r'', VIMSPage),
+    (('kickoff', 'ko'), r'', KickoffPage),
+    (('fmsdump',), r'', GetFRCSpyDump),
+    (('calendar', 'cal'), r'', CalendarPage),
+    (('cookie',), r'', CookiePage),
+    (('api',), r'teams', TeamsApiPage),
+    (('api',), r'events?/' + eventPattern, EventLinksApiPage),
+    (('api',), r'events', EventLinksApiPage),
+    (('api',), r'roster/' + eventPattern, EventRosterApiPage),
+    (('api',), r'teamevents/(?P<team>\d+)(?:/(?P<year>\d{4}))?',
+     TeamEventsApiPage),
+    (('tasks',), r'warmteams', WarmTeamsPage),
+    (('tasks',), r'rosters', ScrapeRostersPage),
+    (('tasks',), r'prefetch(?:/' + eventPattern + ')?', PrefetchTeamsPage),
+    (('tasks',), r'refreshteam/(?P<tpid>\d+)', RefreshTeamDetailsPage),
+    (('tasks',), r'migrateteams', MigrateTeamsPage),
+    (('tasks',), r'exportteams', ExportTeamsPage),
+    (('tasks',), r'flushteams', FlushTeamsPage),
+    (('scrapeteams',), r'(?P<year>\d{4})/(?P<start>\d+)', ScrapeTeamsPage),
+    (('stats',), r'', StatsPage),
+    (('robots.txt',), r'', RobotsTxtPage),
+    (('usfirst.org',), r'', ReferrerRedirectPage),
+  ]
+
+# The route table compiled into a lookup by first path segment, so that a
+# request only tries the handful of patterns registered for its segment instead
+# of scanning the whole table. Built on first use, since the live redirect route
+# doesn't need it.
+routeIndex = None
+
+def GetRouteIndex():
+  """
+  Returns the compiled route index, building it if needed.
+  """
+  global routeIndex
+  if routeIndex is None:
+    index = {}
+    for segments, pattern, handler in routes:
+      compiledPattern = re.compile(r'(?:%s)/?$' % pattern, re.IGNORECASE)
+      for segment in segments:
+        index.setdefault(segment, []).append((compiledPattern, handler))
+    routeIndex = index
+  return routeIndex
+
+def Dispatch(path):
+  """
+  Returns the handler for the given path along with the parameters captured from
+  it. Falls back to the instructions page for unrecognized paths.
+  """
+  segments = path.split('/', 2)
+  if len(segments) < 2:
+    return InstructionPage, {}
+  remainder = ''
+  if len(segments) > 2:
+    remainder = segments[2]
+  for compiledPattern, handler in GetRouteIndex().get(segments[1].lower(), ()):
+    match = compiledPattern.match(remainder)
+    if match:
+      return handler, match.groupdict()
+  return InstructionPage, {}
+
+def NormalizePath(path):
+  """
+  Returns the canonical form of the given path used as the resolve cache key.
+  """
+  if path.endswith('/'):
+    path = path[:-1]
+  segments = path.split('/', 2)
+  if len(segments) > 1:
+    segments[1] = segments[1].lower()
+  return '/'.join(segments)
+
+def Resolve(path):
+  """
+  Returns the destination URL for the given path, or None if the path isn't
+  served by a RedirectPage. Has no side effects other than caching the result.
+  """
+  path = NormalizePath(path)
+  url = resolveCache.Get(path)
+  if url is None:
+    handlerClass, params = Dispatch(path)
+    if not issubclass(handlerClass, RedirectPage):
+      return None
+    url = handlerClass.GetUrl(**params)
+    resolveCache.Set(path, url)
+  return url
+
+class DispatchPage(webapp.RequestHandler):
+  """
+  Hands the request off to the handler that the route table maps it to.
+  """
+  def get(self):
+    handlerClass, params = Dispatch(self.request.path)
+    handler = handlerClass()
+    handler.initialize(self.request, self.response)
+    handler.get(**params)
+
+def RouteNamer(appRoutes):
+  """
+  Returns a function giving the name that stats are recorded under for a path,
+  which is the handler that the given application routes serve it with, looking
+  through DispatchPage to the handler it dispatches to.
+  """
+  compiledRoutes = [(re.compile('^%s$' % pattern), handler)
+                    for pattern, handler in appRoutes]
+  def RouteName(path):
+    for compiledPattern, handler in compiledRoutes:
+      if compiledPattern.match(path):
+        if handler is DispatchPage:
+          handler = Dispatch(NormalizePath(path))[0]
+        return handler.__name__
+    return 'NotFound'
+  return RouteName
+
+InstallRpcHook()
+
+# The legacy routes have been retired in favour of the new FRCLinks application;
+# swap DispatchPage back in to serve them again. The admin pages stay live.
+appRoutes = [
+    ('/(?:tasks/.*|stats/?|api/.*)', DispatchPage),
+    # ('.*', DispatchPage),
     ('.*', NewFrcLinksRedirectPage)
-  ],
-  debug=True)
+  ]
+
+application = StatsMiddleware(webapp.WSGIApplication(appRoutes, debug=True),
+                              RouteNamer(appRoutes))
 
 def main():
   run_wsgi_app(application)
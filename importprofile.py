@@ -0,0 +1,105 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Reports how long importing the application takes, broken down by module, so
+that regressions in instance startup time are caught before a deploy.
+
+Run from the application directory with the App Engine SDK on the path:
+
+  python importprofile.py --budget 150
+
+Prints each module imported while loading frclinks with the time spent in it
+including its own imports, slowest first, and exits with an error if the total
+exceeds the budget in milliseconds.
+"""
+
+import __builtin__
+import argparse
+import os
+import sys
+import time
+
+try:
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+except ImportError:
+  pass
+
+# Selects the template library bundled for the python27 runtime, as in
+# production.
+os.environ.setdefault('APPENGINE_RUNTIME', 'python27')
+
+def ProfileImport(moduleName):
+  '''
+  Imports the given module, returning the total time taken and a list of
+  (milliseconds, depth, name) for each module loaded along the way, in the order
+  their imports started.
+  '''
+  originalImport = __builtin__.__import__
+  timings = []
+  depth = [0]
+
+  def TimedImport(name, *args, **kwargs):
+    alreadyLoaded = name in sys.modules
+    if alreadyLoaded:
+      return originalImport(name, *args, **kwargs)
+    entry = [0, depth[0], name]
+    timings.append(entry)
+    depth[0] += 1
+    startTime = time.time()
+    try:
+      return originalImport(name, *args, **kwargs)
+    finally:
+      entry[0] = (time.time() - startTime) * 1000
+      depth[0] -= 1
+
+  __builtin__.__import__ = TimedImport
+  startTime = time.time()
+  try:
+    __import__(moduleName)
+  finally:
+    __builtin__.__import__ = originalImport
+  return (time.time() - startTime) * 1000, timings
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--module', default='frclinks')
+  parser.add_argument('--budget', type=float,
+                      help='fail if the import takes longer, in milliseconds')
+  parser.add_argument('--top', type=int, default=25,
+                      help='number of modules to list')
+  args = parser.parse_args()
+
+  total, timings = ProfileImport(args.module)
+  print '%10s  %s' % ('ms', 'module')
+  for milliseconds, depth, name in sorted(timings, reverse=True)[:args.top]:
+    print '%10.1f  %s%s' % (milliseconds, '  ' * depth, name)
+  print 'Imported %s in %.1f ms (%d modules).' % (args.module, total,
+                                                  len(timings))
+  if args.budget is not None and total > args.budget:
+    print 'Over the budget of %.1f ms.' % args.budget
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,152 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Keeps the team list of each event cached, along with the reverse lookup of the
+events each team is registered for, so that neither needs a trip to FIRST.
+"""
+
+import array
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+from cache import LruCache
+from team import FetchEventTeams
+
+# In-process cache of the roster index by year, as built by GetRosterIndex.
+rosterIndexCache = LruCache(4, ttl=600)
+
+# How many runs in a row may fail to fetch an event's team list before
+# ScrapeRosters skips the event, so that one broken event can't hold up the rest.
+rosterFetchTries = 3
+
+class EventRoster(db.Model):
+  '''
+  Stores the numbers of the teams registered for an event, keyed by year and
+  event code (e.g. "2018/casj"), packed as sorted unsigned shorts.
+  '''
+  year = db.IntegerProperty()
+  teams = db.BlobProperty()
+  fetchTime = db.FloatProperty(indexed=False)
+
+class RosterIndex(object):
+  '''
+  Holds the rosters of every event in a season as sorted tuples of team numbers,
+  along with the events each team is registered for, for constant-time lookups.
+  '''
+  def __init__(self, packedRosters):
+    self.rosters = {}
+    self.teamEvents = {}
+    for event, packedTeams in packedRosters.iteritems():
+      numbers = array.array('H')
+      numbers.fromstring(packedTeams)
+      # Packed rosters are already sorted.
+      self.rosters[event] = tuple(numbers)
+      for number in numbers:
+        self.teamEvents.setdefault(number, []).append(event)
+    for events in self.teamEvents.itervalues():
+      events.sort()
+
+def PackTeams(numbers):
+  '''
+  Returns the given team numbers packed for storage in an EventRoster.
+  '''
+  return array.array('H', sorted(set(numbers))).tostring()
+
+def GetRosterIndex(year):
+  '''
+  Returns the RosterIndex for the given season, building it from memcache or, if
+  it isn't there, the datastore.
+  '''
+  index = rosterIndexCache.Get(year)
+  if index is None:
+    packedRosters = memcache.get(year, namespace="Rosters")
+    if packedRosters is None:
+      packedRosters = {}
+      for roster in EventRoster.all().filter('year =', int(year)):
+        packedRosters[roster.key().name().split('/')[1]] = roster.teams
+      memcache.set(year, packedRosters, namespace="Rosters")
+    index = RosterIndex(packedRosters)
+    rosterIndexCache.Set(year, index)
+  return index
+
+def GetEventRoster(event, year):
+  '''
+  Returns the sorted numbers of the teams registered for the given event, or
+  None if its roster hasn't been cached.
+  '''
+  return GetRosterIndex(year).rosters.get(event.lower())
+
+def GetTeamEvents(number, year):
+  '''
+  Returns the codes of the cached events that the given team is registered for.
+  '''
+  return GetRosterIndex(year).teamEvents.get(int(number), [])
+
+def ScrapeRosters(year, events, teamListUrl, timeBudget=20):
+  '''
+  Caches the roster of each of the given events from its FIRST team list, whose
+  URL is given by teamListUrl(event, year), until done or the time budget (in
+  seconds) runs out. Saves its place in memcache, including when a fetch fails,
+  so that running it again resumes where it left off. An event whose fetch has
+  failed rosterFetchTries times in a row is skipped, keeping any roster already
+  cached for it. Returns true once every event has been scraped or skipped.
+  '''
+  startTime = time.time()
+  position = memcache.get(year, namespace="RosterProgress") or 0
+  while position < len(events):
+    if time.time() - startTime >= timeBudget:
+      memcache.set(year, position, namespace="RosterProgress")
+      return False
+    event = events[position].lower()
+    failuresKey = '%s/%s' % (year, event)
+    try:
+      numbers = FetchEventTeams(teamListUrl(event, year))
+    except Exception:
+      failures = memcache.incr(failuresKey, namespace="RosterFailures",
+                               initial_value=0)
+      if failures < rosterFetchTries:
+        memcache.set(year, position, namespace="RosterProgress")
+        raise
+      logging.exception('Skipping the roster of %s for %s after %d failed '
+                        'fetches.', event, year, failures)
+      memcache.delete(failuresKey, namespace="RosterFailures")
+      position += 1
+      continue
+    except:
+      # Running out of request time isn't the event's fault; just resume here.
+      memcache.set(year, position, namespace="RosterProgress")
+      raise
+    memcache.delete(failuresKey, namespace="RosterFailures")
+    EventRoster(key_name='%s/%s' % (year, event), year=int(year),
+                teams=PackTeams(numbers), fetchTime=time.time()).put()
+    position += 1
+
+  logging.info('Cached the rosters of %d events for %s.', len(events), year)
+  memcache.delete(year, namespace="RosterProgress")
+  memcache.delete(year, namespace="Rosters")
+  rosterIndexCache.Clear()
+  return True
@@ -0,0 +1,193 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Records per-route latency and the time and RPCs each request spends in the
+services it calls, for a sample of requests.
+"""
+
+import bisect
+import functools
+import json
+import logging
+import random
+import threading
+import time
+
+# Fraction of requests to instrument. With sampling off, instrumented functions
+# cost one thread-local lookup per call.
+sampleRate = 0.0
+
+# Upper bounds of the latency histogram buckets, in milliseconds. The last
+# bucket holds everything slower.
+bucketBounds = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+class Histogram(object):
+  '''
+  Counts latencies into fixed buckets, keeping their total so that the mean can
+  be derived.
+  '''
+  def __init__(self):
+    self.counts = [0] * (len(bucketBounds) + 1)
+    self.total = 0.0
+
+  def Add(self, milliseconds):
+    self.counts[bisect.bisect_left(bucketBounds, milliseconds)] += 1
+    self.total += milliseconds
+
+  def ToDict(self):
+    count = sum(self.counts)
+    buckets = {}
+    for bound, bucketCount in zip(bucketBounds + ['inf'], self.counts):
+      if bucketCount:
+        buckets[str(bound)] = bucketCount
+    return {
+      'count': count,
+      'meanMs': count and round(self.total / count, 1),
+      'buckets': buckets,
+    }
+
+class RouteStats(object):
+  '''
+  Holds the latency histogram of one route, along with the histogram of each
+  instrumented call and the RPC counts of the requests sampled on it.
+  '''
+  def __init__(self):
+    self.latency = Histogram()
+    self.calls = {}
+    self.rpcs = {}
+
+# Stats for this instance, keyed by route name.
+routeStats = {}
+statsLock = threading.Lock()
+
+# Per-thread record of the request being sampled, if any.
+current = threading.local()
+
+class RequestRecord(object):
+  '''
+  Accumulates the calls and RPCs of one sampled request.
+  '''
+  def __init__(self):
+    self.calls = {}
+    self.rpcs = {}
+
+def Timed(name):
+  '''
+  Returns a decorator that records the time spent in the decorated function
+  under the given name whenever the current request is being sampled.
+  '''
+  def Decorate(func):
+    @functools.wraps(func)
+    def Wrapper(*args, **kwargs):
+      record = getattr(current, 'record', None)
+      if record is None:
+        return func(*args, **kwargs)
+      startTime = time.time()
+      try:
+        return func(*args, **kwargs)
+      finally:
+        record.calls.setdefault(name, []).append(
+            (time.time() - startTime) * 1000)
+    return Wrapper
+  return Decorate
+
+def CountRpc(service, call, request, response):
+  '''
+  Counts an App Engine API call against the current request if it is being
+  sampled. Installed as an apiproxy pre-call hook.
+  '''
+  record = getattr(current, 'record', None)
+  if record is not None:
+    key = service + '.' + call
+    record.rpcs[key] = record.rpcs.get(key, 0) + 1
+
+def InstallRpcHook():
+  '''
+  Starts counting App Engine API calls made by sampled requests.
+  '''
+  from google.appengine.api import apiproxy_stub_map
+  apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('stats', CountRpc)
+
+class StatsMiddleware(object):
+  '''
+  Times a sample of the requests to the wrapped application, attributing them
+  to the route name returned by routeName for the request path, and logs one
+  structured line for each.
+  '''
+  def __init__(self, app, routeName):
+    self.app = app
+    self.routeName = routeName
+
+  def __call__(self, environ, start_response):
+    if not sampleRate or random.random() >= sampleRate:
+      return self.app(environ, start_response)
+
+    record = RequestRecord()
+    current.record = record
+    startTime = time.time()
+    try:
+      return self.app(environ, start_response)
+    finally:
+      current.record = None
+      latency = (time.time() - startTime) * 1000
+      route = self.routeName(environ.get('PATH_INFO', '/'))
+      Record(route, latency, record)
+      logging.info('request_stats %s', json.dumps({
+        'route': route,
+        'path': environ.get('PATH_INFO', '/'),
+        'latencyMs': round(latency, 1),
+        'calls': dict((name, round(sum(times), 1))
+                      for name, times in record.calls.iteritems()),
+        'rpcs': record.rpcs,
+      }, sort_keys=True))
+
+def Record(route, latency, record):
+  '''
+  Adds a sampled request to the stats of the given route.
+  '''
+  with statsLock:
+    stats = routeStats.get(route)
+    if stats is None:
+      stats = routeStats[route] = RouteStats()
+    stats.latency.Add(latency)
+    for name, times in record.calls.iteritems():
+      histogram = stats.calls.get(name)
+      if histogram is None:
+        histogram = stats.calls[name] = Histogram()
+      for callTime in times:
+        histogram.Add(callTime)
+    for key, count in record.rpcs.iteritems():
+      stats.rpcs[key] = stats.rpcs.get(key, 0) + count
+
+def GetStats():
+  '''
+  Returns the stats recorded on this instance, keyed by route name.
+  '''
+  with statsLock:
+    return dict((route, {
+        'latency': stats.latency.ToDict(),
+        'calls': dict((name, histogram.ToDict())
+                      for name, histogram in stats.calls.iteritems()),
+        'rpcs': dict(stats.rpcs),
+      }) for route, stats in routeStats.iteritems())
@@ -25,96 +25,884 @@ Provides functions for caching and retrieving the location of FIRST team info
 pages.
 """
 
+import array
+import collections
+import hashlib
+import json
+import logging
+import os
 import re
+import threading
+import time
 
 from google.appengine.api import memcache
-from google.appengine.api import urlfetch
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
 
-# Separates tpids on the FIRST list of all teams.
-teamRe = re.compile(r'tpid=(\d+)[A-Za-z0-9=&;\-:]*?"><b>(\d+)')
+from cache import LruCache
+from stats import Timed
+import upstream
+
+# In-process cache of tpids (or "null" for unknown teams) by team number, in
+# front of the memcache "Team" namespace.
+teamCache = LruCache(2000, ttl=600)
+
+# Version stamp of the team data that teamCache holds. The stamp in memcache is
+# bumped whenever the data changes, and is checked every teamCacheCheckSeconds
+# so that changes made on other instances clear this instance's cache.
+teamCacheVersion = None
+teamCacheCheckTime = 0
+teamCacheCheckSeconds = 10
+teamCacheLock = threading.Lock()
+
+# Snapshot of the team number->tpid table bundled with the app, exported by
+# ExportTeamSnapshot. Holds (number, tpid, year) triples sorted by number in a
+# flat array, and is loaded on first use.
+teamSnapshotPath = os.path.join(os.path.dirname(__file__), 'teams.bin')
+teamSnapshot = None
+
+# The current FIRST season, kept in step with frclinks.defaultYear. Since a
+# team's tpid only changes between seasons, snapshot entries from it are served
+# without checking memcache for a newer one.
+currentSeason = 2018
+teamSnapshotLock = threading.Lock()
+
+# How long a team number is remembered as unknown, in seconds, so that newly
+# registered teams are picked up.
+negativeTeamSeconds = 3600
+
+# How often the FIRST website may be scraped for any one team, in seconds.
+scrapeRetrySeconds = 3600
+
+# Bitmap of every team number in the datastore and whether it is complete, as
+# a (bits, complete) pair, loaded on first use and reloaded whenever the team
+# data changes.
+knownTeams = None
+
+# Counts where tpid lookups were served from.
+lookupStats = {'l1': 0, 'snapshot': 0, 'filter': 0, 'memcache': 0,
+               'datastore': 0}
+lookupStatsLock = threading.Lock()
+
+# Separates tpids on the FIRST list of all teams. Requires a non-digit after the
+# team number so that a number cut off at the end of a chunk isn't matched.
+teamRe = re.compile(r'tpid=(\d+)[A-Za-z0-9=&;\-:]*"><b>(\d+)(?=\D)')
+
+# Address of the FIRST list of all teams. Can be pointed at a stand-in server
+# when running locally.
+teamListUrl = 'https://my.usfirst.org/myarea/index.lasso'
+
+# Address of the FIRST team search service, which provides team details by tpid.
+teamSearchUrl = 'http://es01.usfirst.org/teams/_search'
+
+# How long cached team details are served before being refreshed, in seconds.
+teamDetailsSeconds = 7 * 24 * 3600
+
+# Number of teams to request at once from the FIRST team search when
+# prefetching team details.
+prefetchBatchSize = 50
+
+# Number of pages of the FIRST list of all teams to fetch at once.
+scrapeConcurrency = 4
+
+# Number of teams whose records StoreTeams reads and writes at once, so that a
+# page is stored as it is parsed rather than held in full.
+storeBatchSize = 50
+
+# Number of batches of teams to delete at once when flushing the datastore.
+flushConcurrency = 4
+
+# How long a scrape for one team may hold its lease, in seconds. Requests for
+# the same team on other instances wait this long at most for its result.
+scrapeLeaseSeconds = 60
+
+# Scrapes in progress on this instance, keyed by (team number, year).
+scrapeFlights = {}
+scrapeFlightsLock = threading.Lock()
+
+# Counts scrapes started, and requests that instead waited on a scrape started
+# by another request on this instance or on another instance.
+scrapeStats = {'flights': 0, 'localWaiters': 0, 'remoteWaiters': 0}
 
 class TeamTpid(db.Model):
   '''
   Stores a team number->tpid relationship for the most recent season the team was active.
+  Keyed by team number so that teams can be fetched without a query.
   '''
   number = db.IntegerProperty()
   tpid = db.IntegerProperty()
   year = db.IntegerProperty()
 
+class TeamIndexProgress(db.Model):
+  '''
+  Records how far the background warmer has got through the FIRST list of all
+  teams for a season (keyed by year), and a hash of each page as last stored.
+  '''
+  nextStart = db.IntegerProperty(default=0)
+  pageHashes = db.StringListProperty(indexed=False)
+
+class TeamDetails(db.Model):
+  '''
+  Stores the details of a team needed for redirects, keyed by tpid, along with
+  when they were fetched from FIRST.
+  '''
+  webUrl = db.StringProperty(indexed=False)
+  city = db.StringProperty(indexed=False)
+  stateProv = db.StringProperty(indexed=False)
+  country = db.StringProperty(indexed=False)
+  postalCode = db.StringProperty(indexed=False)
+  fetchTime = db.FloatProperty(indexed=False)
+
+class KnownTeams(db.Model):
+  '''
+  Stores a bitmap of every team number in the datastore, so that lookups of
+  numbers that aren't teams can be rejected without an RPC. Teams are added as
+  they are stored, but the bitmap is only complete once MigrateTeams has added
+  every team already in the datastore.
+  '''
+  bits = db.BlobProperty()
+  complete = db.BooleanProperty(default=False, indexed=False)
+
+@Timed('LookupTeam')
 def LookupTeam(number):
   '''
   Retrieves the tpid from the current season for a team.
   '''
-  tpid = memcache.get(number, namespace="Team")
+  CheckTeamCacheVersion()
+  tpid = teamCache.Get(number)
+  if tpid is not None:
+    CountLookups('l1')
+  else:
+    snapshotTeam = LookupSnapshotTeam(number)
+    if snapshotTeam and snapshotTeam[1] == currentSeason:
+      CountLookups('snapshot')
+      tpid = snapshotTeam[0]
+    elif not IsKnownTeam(number):
+      # Once complete, the known teams hold every team that memcache or the
+      # datastore could, so unknown numbers are rejected without an RPC.
+      CountLookups('filter')
+      tpid = "null"
+    else:
+      tpid = memcache.get(number, namespace="Team")
+      if tpid is not None:
+        CountLookups('memcache')
+      elif snapshotTeam:
+        # Entries from older seasons are only served once memcache misses,
+        # since memcache holds teams updated after the snapshot was built.
+        CountLookups('snapshot')
+        tpid = snapshotTeam[0]
+    if tpid is not None:
+      teamCache.Set(number, tpid)
   if tpid == "null":
     return None
   if tpid is not None:
     return tpid
-  team = TeamTpid.all().filter('number =', int(number)).fetch(1)
+  CountLookups('datastore')
+  team = TeamTpid.get_by_key_name(str(int(number)))
+  if team is None and not LoadKnownTeams()[1]:
+    # Fall back to a query for records that haven't been migrated yet, of which
+    # there are none left once the known teams are complete.
+    team = TeamTpid.all().filter('number =', int(number)).get()
   if team:
-    tpid = str(team[0].tpid)
+    tpid = str(team.tpid)
     memcache.add(number, tpid, namespace="Team")
+    teamCache.Set(number, tpid)
     return tpid
 
   # Cache the negative case to prevent spurious datastore lookups for old teams.
-  memcache.add(number, "null", namespace="Team")
+  memcache.add(number, "null", time=negativeTeamSeconds, namespace="Team")
+  teamCache.Set(number, "null")
 
   return None
 
-def ScrapeTeam(number, year):
+def LookupTeams(numbers):
   '''
-  Searches the FIRST list of all teams for the requested team's tpid, caching
-  all it encounters in the datastore.
+  Retrieves the tpids from the current season for several teams at once, using
+  one memcache and one datastore round trip, plus one more for any teams that
+  haven't been migrated to keyed records. Returns a dict of team number to tpid,
+  or to None for teams that weren't found.
   '''
-  skip = 0
-  while 1:
-    scrapeDone = ScrapeTeams(year, skip)
+  numbers = set([str(int(number)) for number in numbers])
+  CheckTeamCacheVersion()
+  cachedTpids = {}
+  uncachedNumbers = []
+  for number in numbers:
+    tpid = teamCache.Get(number)
+    if tpid is None:
+      uncachedNumbers.append(number)
+    else:
+      cachedTpids[number] = tpid
+  CountLookups('l1', len(cachedTpids))
+  # Then the snapshot, the known teams and memcache, as in LookupTeam.
+  snapshotTeams = {}
+  knownNumbers = []
+  for number in uncachedNumbers:
+    snapshotTeam = LookupSnapshotTeam(number)
+    if snapshotTeam and snapshotTeam[1] == currentSeason:
+      CountLookups('snapshot')
+      teamCache.Set(number, snapshotTeam[0])
+      cachedTpids[number] = snapshotTeam[0]
+    elif IsKnownTeam(number):
+      snapshotTeams[number] = snapshotTeam
+      knownNumbers.append(number)
+    else:
+      CountLookups('filter')
+      teamCache.Set(number, "null")
+      cachedTpids[number] = "null"
+  if knownNumbers:
+    memcacheTpids = memcache.get_multi(knownNumbers, namespace="Team")
+    CountLookups('memcache', len(memcacheTpids))
+    for number, tpid in memcacheTpids.iteritems():
+      teamCache.Set(number, tpid)
+    cachedTpids.update(memcacheTpids)
+  for number in knownNumbers:
+    if number not in cachedTpids and snapshotTeams[number]:
+      CountLookups('snapshot')
+      teamCache.Set(number, snapshotTeams[number][0])
+      cachedTpids[number] = snapshotTeams[number][0]
+
+  tpids = {}
+  missingNumbers = []
+  for number in numbers:
+    tpid = cachedTpids.get(number)
+    if tpid is None:
+      missingNumbers.append(number)
+    elif tpid == "null":
+      tpids[number] = None
+    else:
+      tpids[number] = tpid
+
+  if missingNumbers:
+    CountLookups('datastore', len(missingNumbers))
+    # Cache the negative cases too, as LookupTeam does.
+    newTpids = {}
+    unknownNumbers = {}
+    keyedTeams = TeamTpid.get_by_key_name(missingNumbers)
+    # Fall back to queries for records that haven't been migrated yet, started
+    # together so that they run concurrently. None are left once the known
+    # teams are complete.
+    legacyQueries = {}
+    if not LoadKnownTeams()[1]:
+      for number, team in zip(missingNumbers, keyedTeams):
+        if team is None:
+          legacyQueries[number] = TeamTpid.all().filter(
+              'number =', int(number)).run(limit=1)
+    for number, team in zip(missingNumbers, keyedTeams):
+      if number in legacyQueries:
+        team = next(legacyQueries[number], None)
+      if team:
+        tpids[number] = newTpids[number] = str(team.tpid)
+      else:
+        tpids[number] = None
+        unknownNumbers[number] = "null"
+    memcache.add_multi(newTpids, namespace="Team")
+    memcache.add_multi(unknownNumbers, time=negativeTeamSeconds,
+                       namespace="Team")
+    for number, tpid in newTpids.items() + unknownNumbers.items():
+      teamCache.Set(number, tpid)
+  return tpids
+
+def IsKnownTeam(number):
+  '''
+  Returns false if the given number isn't a team in the datastore. Returns true
+  if it is, or if the known teams aren't complete yet.
+  '''
+  bits, complete = LoadKnownTeams()
+  if not complete:
+    return True
+  return HasBit(bits, int(number))
+
+def HasBit(bits, number):
+  '''
+  Returns true if the given number is set in the given bitmap.
+  '''
+  return number >> 3 < len(bits) and bool(bits[number >> 3] & (1 << (number & 7)))
+
+def LoadKnownTeams():
+  '''
+  Returns the bitmap of known team numbers and whether it is complete, loading
+  them on first use.
+  '''
+  global knownTeams
+  loadedTeams = knownTeams
+  if loadedTeams is None:
+    data = memcache.get("known", namespace="KnownTeams")
+    if data is None:
+      stored = KnownTeams.get_by_key_name("all")
+      data = stored and (stored.bits or '', stored.complete) or ('', False)
+      memcache.set("known", data, namespace="KnownTeams")
+    loadedTeams = knownTeams = (bytearray(data[0]), data[1])
+  return loadedTeams
+
+def AddKnownTeams(numbers, complete=False):
+  '''
+  Adds the given team numbers to the bitmap of known teams, if any are new, and
+  marks it complete if asked to.
+  '''
+  global knownTeams
+  bits, wasComplete = LoadKnownTeams()
+  if (all([HasBit(bits, number) for number in numbers]) and
+      (wasComplete or not complete)):
+    return
+
+  # Merge in a transaction so that concurrent requests don't drop each other's
+  # teams.
+  def Merge():
+    stored = (KnownTeams.get_by_key_name("all") or
+              KnownTeams(key_name="all"))
+    bits = bytearray(stored.bits or '')
+    for number in numbers:
+      if number >> 3 >= len(bits):
+        bits.extend('\0' * ((number >> 3) + 1 - len(bits)))
+      bits[number >> 3] |= 1 << (number & 7)
+    stored.bits = db.Blob(str(bits))
+    stored.complete = stored.complete or complete
+    stored.put()
+    return bits, stored.complete
+  loadedTeams = db.run_in_transaction(Merge)
+  # Drop rather than overwrite the memcache copy, which a concurrent merge may
+  # already have replaced with a newer bitmap.
+  memcache.delete("known", namespace="KnownTeams")
+  knownTeams = loadedTeams
+
+def AllowScrape(number):
+  '''
+  Returns true if the FIRST website may be scraped for the given team, which is
+  allowed at most once every scrapeRetrySeconds for each team.
+  '''
+  return memcache.add(str(int(number)), 1, time=scrapeRetrySeconds,
+                      namespace="ScrapeAttempt")
+
+def LoadTeamSnapshot():
+  '''
+  Returns the bundled team snapshot, loading it on first use. Returns an empty
+  snapshot if none was bundled.
+  '''
+  global teamSnapshot
+  if teamSnapshot is None:
+    with teamSnapshotLock:
+      if teamSnapshot is None:
+        snapshot = array.array('i')
+        if os.path.exists(teamSnapshotPath):
+          snapshot.fromstring(open(teamSnapshotPath, 'rb').read())
+        teamSnapshot = snapshot
+  return teamSnapshot
+
+def LookupSnapshotTeam(number):
+  '''
+  Retrieves a team's tpid and the season it is from out of the bundled snapshot
+  by binary search, or None if the team is newer than the snapshot.
+  '''
+  snapshot = LoadTeamSnapshot()
+  number = int(number)
+  low = 0
+  high = len(snapshot) / 3
+  while low < high:
+    middle = (low + high) / 2
+    middleNumber = snapshot[middle * 3]
+    if middleNumber < number:
+      low = middle + 1
+    elif middleNumber > number:
+      high = middle
+    else:
+      return str(snapshot[middle * 3 + 1]), snapshot[middle * 3 + 2]
+  return None
+
+def ExportTeamSnapshot():
+  '''
+  Returns the contents of a snapshot file of every team in the datastore, to be
+  saved as teams.bin and bundled with the next deploy.
+  '''
+  latestTeams = {}
+  for team in TeamTpid.all().run(batch_size=1000):
+    latestTeam = latestTeams.get(team.number)
+    if latestTeam is None or latestTeam.year < team.year:
+      latestTeams[team.number] = team
+  snapshot = array.array('i')
+  for number in sorted(latestTeams):
+    team = latestTeams[number]
+    snapshot.extend([team.number, team.tpid, team.year])
+  return snapshot.tostring()
+
+def CountLookups(level, count=1):
+  '''
+  Records that the given number of tpid lookups were served from the given level
+  of caching.
+  '''
+  with lookupStatsLock:
+    lookupStats[level] += count
+
+def GetLookupStats():
+  '''
+  Returns the share of tpid lookups served from each level of caching.
+  '''
+  with lookupStatsLock:
+    total = sum(lookupStats.values())
+    ratios = {}
+    for level, count in lookupStats.iteritems():
+      ratios[level] = float(count) / total if total else 0.0
+  return ratios
+
+def CheckTeamCacheVersion():
+  '''
+  Clears teamCache if the team data has changed on another instance, checking
+  the version stamp in memcache at most every teamCacheCheckSeconds.
+  '''
+  global teamCacheVersion, teamCacheCheckTime, knownTeams
+  now = time.time()
+  with teamCacheLock:
+    if now - teamCacheCheckTime < teamCacheCheckSeconds:
+      return
+    teamCacheCheckTime = now
+  version = memcache.get("version", namespace="TeamVersion")
+  with teamCacheLock:
+    if version != teamCacheVersion:
+      teamCache.Clear()
+      knownTeams = None
+      teamCacheVersion = version
+
+def InvalidateTeamCache(tpids=None):
+  '''
+  Records that the team data has changed, updating teamCache with the given
+  tpids by team number or clearing it if none are given, and bumping the version
+  stamp so that other instances clear theirs.
+  '''
+  global teamCacheVersion
+  version = memcache.incr("version", namespace="TeamVersion", initial_value=0)
+  with teamCacheLock:
+    if tpids is None:
+      teamCache.Clear()
+    else:
+      for number, tpid in tpids.iteritems():
+        teamCache.Set(number, tpid)
+    teamCacheVersion = version
+
+def GetTeamDetails(tpid):
+  '''
+  Retrieves the details of the team with the given tpid, from memcache or the
+  datastore if possible, or None if FIRST has no such team. Details older than
+  teamDetailsSeconds are still served, but a task is queued to refresh them so
+  that a slow FIRST website doesn't slow down the request.
+  '''
+  details = memcache.get(tpid, namespace="TeamDetails")
+  if details is None:
+    details = TeamDetails.get_by_key_name(tpid)
+    if details is None:
+      return FetchTeamDetails(tpid)
+    memcache.set(tpid, details, namespace="TeamDetails")
+
+  if time.time() - details.fetchTime > teamDetailsSeconds:
+    # Only queue one refresh at a time for each team.
+    if memcache.add(tpid, 1, time=600, namespace="TeamDetailsRefresh"):
+      taskqueue.add(url='/tasks/refreshteam/' + tpid, method='GET')
+  return details
+
+def FetchTeamDetails(tpid):
+  '''
+  Fetches the details of the team with the given tpid from the FIRST website and
+  caches them in memcache and the datastore. Returns None if FIRST has no team
+  with that tpid.
+  '''
+  return FetchTeamDetailsBatch([tpid]).get(tpid)
+
+def FetchTeamDetailsBatch(tpids):
+  '''
+  Fetches the details of all the teams with the given tpids from the FIRST
+  website in a single query and caches them in memcache and the datastore.
+  Returns the details keyed by tpid.
+  '''
+  teamQueryUrl = (teamSearchUrl + '?size=%d&source={' % len(tpids) +
+      '"query":{"query_string":{"query":"_id:(' + '%20OR%20'.join(tpids) +
+      ')"}}}')
+  teamInfoPage = upstream.Fetch(teamQueryUrl)
+  teamInfo = json.loads(teamInfoPage.content)
+  teamDetails = {}
+  for hit in teamInfo['hits']['hits']:
+    source = hit['_source']
+    teamDetails[str(hit['_id'])] = TeamDetails(
+        key_name=str(hit['_id']),
+        webUrl=source.get('team_web_url') or '',
+        city=source.get('team_city') or '',
+        stateProv=source.get('team_stateprov') or '',
+        country=source.get('team_country') or '',
+        postalCode=source.get('team_postalcode') or '',
+        fetchTime=time.time())
+  if teamDetails:
+    db.put(teamDetails.values())
+    memcache.set_multi(teamDetails, namespace="TeamDetails")
+  return teamDetails
+
+def PrefetchTeamDetails(numbers):
+  '''
+  Caches the details of all the given teams that aren't cached already, fetching
+  them from the FIRST website in as few queries as possible. Returns how many
+  queries this saved compared with fetching each team on its own.
+  '''
+  tpids = [tpid for tpid in LookupTeams(numbers).itervalues() if tpid]
+  cachedDetails = memcache.get_multi(tpids, namespace="TeamDetails")
+  missingTpids = [tpid for tpid in tpids if tpid not in cachedDetails]
+  if not missingTpids:
+    return 0
+
+  # Copy any details only found in the datastore into memcache.
+  storedDetails = {}
+  for tpid, details in zip(missingTpids,
+                           TeamDetails.get_by_key_name(missingTpids)):
+    if details is not None:
+      storedDetails[tpid] = details
+  if storedDetails:
+    memcache.set_multi(storedDetails, namespace="TeamDetails")
+
+  fetchTpids = [tpid for tpid in missingTpids if tpid not in storedDetails]
+  queries = 0
+  for i in xrange(0, len(fetchTpids), prefetchBatchSize):
+    FetchTeamDetailsBatch(fetchTpids[i:i + prefetchBatchSize])
+    queries += 1
+  logging.info('Prefetched details for %d of %d teams in %d queries.',
+               len(fetchTpids), len(tpids), queries)
+  return len(fetchTpids) - queries
+
+def FetchEventTeams(teamListUrl):
+  '''
+  Retrieves the numbers of the teams listed on the given FIRST event team list.
+  '''
+  teamList = upstream.Fetch(teamListUrl, headers={'Referer': 'usfirst.org'})
+  return [int(teamResult[1]) for teamResult in IterTeams(teamList.content)]
+
+class ScrapeFlight(object):
+  '''
+  Tracks a scrape in progress so that concurrent requests for the same team can
+  wait for its result instead of starting their own.
+  '''
+  def __init__(self):
+    self.done = threading.Event()
+    self.tpid = None
+    self.waiters = 0
+
+def ScrapeTeamOnce(number, year):
+  '''
+  Scrapes the FIRST website for the requested team's tpid, unless a scrape for
+  the same team and year is already in flight on this or another instance, in
+  which case waits for and returns its result.
+  '''
+  number = str(int(number))
+  flightKey = (number, year)
+  with scrapeFlightsLock:
+    flight = scrapeFlights.get(flightKey)
+    isLeader = flight is None
+    if isLeader:
+      flight = scrapeFlights[flightKey] = ScrapeFlight()
+      scrapeStats['flights'] += 1
+    else:
+      flight.waiters += 1
+      scrapeStats['localWaiters'] += 1
+  if not isLeader:
+    flight.done.wait(scrapeLeaseSeconds)
+    return flight.tpid
+
+  try:
+    flight.tpid = ScrapeTeamWithLease(number, year)
+  finally:
+    with scrapeFlightsLock:
+      del scrapeFlights[flightKey]
+    flight.done.set()
+  if flight.waiters:
+    logging.info('Scrape for team %s in %s served %d waiting requests.', number,
+                 year, flight.waiters)
+  return flight.tpid
+
+def ScrapeTeamWithLease(number, year):
+  '''
+  Scrapes for the requested team's tpid while holding a memcache lease, or waits
+  for the result if another instance already holds it.
+  '''
+  leaseKey = '%s/%s' % (year, number)
+  if memcache.add(leaseKey, 1, time=scrapeLeaseSeconds, namespace="ScrapeLease"):
+    try:
+      tpid = ScrapeTeam(number, year)
+      if tpid:
+        memcache.set(number, tpid, namespace="Team")
+        teamCache.Set(number, tpid)
+      return tpid
+    finally:
+      memcache.delete(leaseKey, namespace="ScrapeLease")
+
+  # Another instance is already scraping for this team, so wait for its result.
+  with scrapeFlightsLock:
+    scrapeStats['remoteWaiters'] += 1
+  deadline = time.time() + scrapeLeaseSeconds
+  while time.time() < deadline:
+    time.sleep(0.5)
     tpid = memcache.get(number, namespace="Team")
     if tpid and tpid != "null":
       return tpid
-    if scrapeDone:
+    if memcache.get(leaseKey, namespace="ScrapeLease") is None:
       return None
-    skip += 250
+  return None
+
+def ScrapeTeam(number, year):
+  '''
+  Searches the FIRST list of all teams for the requested team's tpid, fetching
+  several pages at once and caching all it encounters in the datastore. Returns
+  as soon as a page turns up the team.
+  '''
+  number = int(number)
+  skip = 0
+  pendingRpcs = collections.deque()
+  try:
+    while True:
+      # Keep up to scrapeConcurrency pages in flight, or as many as the host's
+      # share of upstream calls allows.
+      while len(pendingRpcs) < scrapeConcurrency:
+        try:
+          pendingRpcs.append((skip, FetchTeamList(year, skip)))
+        except upstream.UnavailableError:
+          if not pendingRpcs:
+            raise
+          break
+        skip += 250
+
+      # Handle the pages in order while the later ones stay in flight, so that
+      # lookahead is bounded however the responses are scheduled.
+      start, rpc = pendingRpcs.popleft()
+      teamCount, tpid = StoreTeams(year, start,
+                                   upstream.GetResult(rpc).content, number)
+      if tpid is not None:
+        return tpid
+      # The pages still in flight are past the end of the list.
+      if teamCount < 250:
+        return None
+  finally:
+    # Give back the upstream slots of pages that won't be waited on.
+    for start, rpc in pendingRpcs:
+      upstream.Release(rpc)
 
+def FetchTeamList(year, start):
+  '''
+  Starts an asynchronous fetch of one page of the FIRST list of all teams for
+  the given season, returning the RPC.
+  '''
+  return upstream.CreateFetchRpc(
+      teamListUrl + '?page=searchresults&' +
+      'programs=FRC&reports=teams&sort_teams=number&results_size=250&' +
+      'omit_searchform=1&season_FRC=' + year + '&skip_teams=' + str(start),
+      headers={'Referer': 'usfirst.org'})
+
+@Timed('ScrapeTeams')
 def ScrapeTeams(year, start):
   '''
   Searches one page of the FIRST list of all teams for the given season, caching
   the tpid of all teams not already cached in the datastore. Returns true if
   there are no more pages of teams to scrape after this one.
   '''
-  teamList = urlfetch.fetch(
-      'https://my.usfirst.org/myarea/index.lasso?page=searchresults&' +
-      'programs=FRC&reports=teams&sort_teams=number&results_size=250&' +
-      'omit_searchform=1&season_FRC=' + year + '&skip_teams=' + str(start),
-      deadline=10, headers={'Referer': 'usfirst.org'})
-  teamResults = teamRe.findall(teamList.content)
-  for teamResult in teamResults:
-    teamNumber = int(teamResult[1])
-    teamTpid = teamResult[0]
-    teamQuery = TeamTpid.all().filter('number =', int(teamNumber))
-    if teamQuery.count() == 0:
-      # Insert a new record for the team.
-      newTeam = TeamTpid()
-      newTeam.number = int(teamNumber)
-      newTeam.tpid = int(teamTpid)
-      newTeam.year = int(year)
-      newTeam.put()
-      memcache.set(str(teamNumber), teamTpid, namespace="Team")
-    elif teamQuery.filter('year <', int(year)).count() != 0:
-      # Updated the existing team record if this tpid is more recent.
-      team = teamQuery.fetch(1)[0]
+  teamList = upstream.GetResult(FetchTeamList(year, start))
+  return StoreTeams(year, start, teamList.content)[0] < 250
+
+def IterTeams(chunks):
+  '''
+  Yields the (tpid, number) pairs on a page of a FIRST team list as they are
+  found, given the page either as a string or as an iterable of chunks of it.
+  '''
+  if isinstance(chunks, basestring):
+    chunks = [chunks]
+  pending = ''
+  for chunk in chunks:
+    pending += chunk
+    end = 0
+    for match in teamRe.finditer(pending):
+      yield match.groups()
+      end = match.end()
+    # Keep only the start of a row that may continue in the next chunk, or the
+    # last few characters in case they're the start of 'tpid='.
+    rowStart = pending.rfind('tpid=', end)
+    if rowStart < 0:
+      rowStart = max(end, len(pending) - len('tpid=') + 1)
+    pending = pending[rowStart:]
+
+def IterBatches(items, size):
+  '''
+  Yields lists of up to the given number of consecutive items.
+  '''
+  batch = []
+  for item in items:
+    batch.append(item)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+def StoreTeams(year, start, content, number=None):
+  '''
+  Caches the tpid of all teams on the given page of the FIRST list of all teams
+  that aren't already cached in the datastore, storeBatchSize at a time as they
+  are parsed. Returns the number of teams found on the page, and the tpid of the
+  given team number if it was among them.
+  '''
+  teamCount = 0
+  numberTpid = None
+  knownNumbers = []
+  cachedTpids = {}
+  putRpcs = []
+  for teamResults in IterBatches(IterTeams(content), storeBatchSize):
+    teamCount += len(teamResults)
+    numbers = [int(teamResult[1]) for teamResult in teamResults]
+    knownNumbers.extend(numbers)
+
+    # Fetch the existing records for every team in this batch in one batch get.
+    existingTeams = TeamTpid.get_by_key_name(
+        [str(teamNumber) for teamNumber in numbers])
+
+    changedTeams = []
+    for teamResult, teamNumber, team in zip(teamResults, numbers,
+                                            existingTeams):
+      teamTpid = teamResult[0]
+      if teamNumber == number:
+        numberTpid = teamTpid
+      if team is None:
+        # Insert a new record for the team.
+        team = TeamTpid(key_name=str(teamNumber))
+        team.number = teamNumber
+      elif team.year >= int(year):
+        continue
+      # Otherwise update the existing team record since this tpid is newer.
       team.tpid = int(teamTpid)
       team.year = int(year)
-      team.put()
-      memcache.set(str(teamNumber), teamTpid, namespace="Team")
-  return len(teamResults) < 250
+      changedTeams.append(team)
+      cachedTpids[str(teamNumber)] = teamTpid
+    if changedTeams:
+      # Write in the background while the next batch is parsed and read.
+      putRpcs.append(db.put_async(changedTeams))
+
+  if not teamCount:
+    logging.info('Scraped no teams at %s for %s.', start, year)
+    return teamCount, numberTpid
+
+  AddKnownTeams(knownNumbers)
+  for putRpc in putRpcs:
+    putRpc.get_result()
+  if cachedTpids:
+    memcache.set_multi(cachedTpids, namespace="Team")
+    InvalidateTeamCache(cachedTpids)
+  logging.info('Scraped %d teams at %s for %s, updating %d.',
+               teamCount, start, year, len(cachedTpids))
+  return teamCount, numberTpid
+
+def WarmTeams(year, timeBudget=50, clock=time.time):
+  '''
+  Refreshes the cached teams for the given season one page at a time, picking
+  up where the last run left off, until the time budget (in seconds) runs out.
+  Pages whose content hasn't changed since they were last stored are skipped.
+  Returns true once it has reached the end of the list, after which the next
+  run starts over from the first page.
+  '''
+  progress = TeamIndexProgress.get_or_insert(year)
+  startTime = clock()
+  while clock() - startTime < timeBudget:
+    start = progress.nextStart
+    content = upstream.GetResult(FetchTeamList(year, start)).content
+    pageIndex = start / 250
+    contentHash = hashlib.md5(content).hexdigest()
+    if (pageIndex < len(progress.pageHashes) and
+        progress.pageHashes[pageIndex] == contentHash):
+      numbers = [int(teamResult[1]) for teamResult in IterTeams(content)]
+      AddKnownTeams(numbers)
+      teamCount = len(numbers)
+    else:
+      teamCount = StoreTeams(year, start, content)[0]
+      if pageIndex < len(progress.pageHashes):
+        progress.pageHashes[pageIndex] = contentHash
+      else:
+        progress.pageHashes.append(contentHash)
+
+    if teamCount < 250:
+      del progress.pageHashes[pageIndex + 1:]
+      progress.nextStart = 0
+      progress.put()
+      return True
+    progress.nextStart = start + 250
+    progress.put()
+  return False
 
-def FlushTeams():
+def FlushTeams(timeBudget=20):
   '''
-  Deletes 500 teams at a time from the datastore (Google limit).
+  Deletes all teams from the datastore, fetching their keys in batches and
+  deleting 500 at a time (Google limit) in parallel until done or the time
+  budget (in seconds) runs out. Saves its place in memcache so that running it
+  again resumes where it left off. Returns true once every team is deleted,
+  along with the warmer's page hashes and the known teams, so that the next
+  warming stores every page again. The known teams stay incomplete, rejecting
+  nothing, until WarmTeamsPage queues the migration after its next full pass.
   '''
-  query = TeamTpid.all()
-  entries = query.fetch(500)
-  db.delete(entries)
-  memcache.flush_all()
+  global knownTeams
+  startTime = time.time()
+  while time.time() - startTime < timeBudget:
+    # Fetch whole records rather than keys, since records written before they
+    # were keyed by team number only hold it in a property.
+    query = TeamTpid.all()
+    cursor = memcache.get("teams", namespace="Flush")
+    if cursor:
+      query.with_cursor(cursor)
+    teams = query.fetch(500 * flushConcurrency)
+    keys = [team.key() for team in teams]
+
+    deleteRpcs = [db.delete_async(keys[i:i + 500])
+                  for i in xrange(0, len(keys), 500)]
+    for deleteRpc in deleteRpcs:
+      deleteRpc.get_result()
+
+    # Only drop the deleted teams from the cache, leaving the rest of it warm.
+    numbers = [str(team.number) for team in teams if team.number is not None]
+    memcache.delete_multi(numbers, namespace="Team")
+    if numbers:
+      InvalidateTeamCache()
+
+    if len(teams) < 500 * flushConcurrency:
+      db.delete(list(TeamIndexProgress.all(keys_only=True)) +
+                [db.Key.from_path('KnownTeams', 'all')])
+      memcache.delete("known", namespace="KnownTeams")
+      knownTeams = None
+      InvalidateTeamCache()
+      memcache.delete("teams", namespace="Flush")
+      return True
+    memcache.set("teams", query.cursor(), namespace="Flush")
+  return False
+
+def MigrateTeams(timeBudget=20):
+  '''
+  Re-keys TeamTpid records written before they were keyed by team number, 500 at
+  a time until done or the time budget (in seconds) runs out. Saves its place in
+  memcache so that running it again resumes where it left off. Returns true once
+  every record has been migrated, by which point every team number has also
+  been added to the known teams and the bitmap is marked complete.
+  '''
+  startTime = time.time()
+  while time.time() - startTime < timeBudget:
+    query = TeamTpid.all()
+    cursor = memcache.get("teams", namespace="Migration")
+    if cursor:
+      query.with_cursor(cursor)
+    entries = query.fetch(500)
+    AddKnownTeams([team.number for team in entries])
+
+    legacyTeams = [team for team in entries if team.key().name() is None]
+    if legacyTeams:
+      keyedTeams = TeamTpid.get_by_key_name(
+          [str(team.number) for team in legacyTeams])
+      latestTeams = {}
+      for team, keyedTeam in zip(legacyTeams, keyedTeams):
+        latestTeam = latestTeams.get(team.number, keyedTeam)
+        if latestTeam is None or latestTeam.year < team.year:
+          latestTeams[team.number] = TeamTpid(key_name=str(team.number),
+                                              number=team.number,
+                                              tpid=team.tpid, year=team.year)
+      db.put(latestTeams.values())
+      db.delete(legacyTeams)
+
+    if len(entries) < 500:
+      AddKnownTeams([], complete=True)
+      InvalidateTeamCache()
+      memcache.delete("teams", namespace="Migration")
+      return True
+    memcache.set("teams", query.cursor(), namespace="Migration")
+  return False
@@ -0,0 +1,255 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Tests for the link handlers.
+"""
+
+import json
+import random
+import threading
+import time
+import unittest
+
+import testutil
+
+from google.appengine.ext import webapp
+
+import frclinks
+import stats
+import team
+
+# Serves every route, including those production sends to frclinks2.
+dispatchApp = webapp.WSGIApplication([('.*', frclinks.DispatchPage)])
+
+class TeamMapPageTest(testutil.TestCase):
+  def setUp(self):
+    testutil.TestCase.setUp(self)
+    team.StoreTeams('2018', 0, testutil.TeamListPage([(1254, 254)]))
+
+  def testMapsLocation(self):
+    self.StartSearch({'1254': {
+      'team_city': 'San Jose', 'team_stateprov': 'CA', 'team_country': 'USA',
+      'team_postalcode': '95126'}})
+    status, headers, body = testutil.Get(dispatchApp, '/m/254')
+    self.assertTrue(
+        'https://www.google.com/maps?q=San Jose+CA+USA+95126"' in body)
+
+  def testSkipsMissingFields(self):
+    self.StartSearch({'1254': {'team_city': 'San Jose', 'team_country': 'USA'}})
+    status, headers, body = testutil.Get(dispatchApp, '/m/254')
+    self.assertTrue(status.startswith('200'))
+    self.assertTrue('https://www.google.com/maps?q=San Jose+USA"' in body)
+
+  def testUnknownTeam(self):
+    self.StartSearch({})
+    status, headers, body = testutil.Get(dispatchApp, '/m/254')
+    self.assertTrue(status.startswith('200'))
+    self.assertTrue('254' in body)
+    self.assertFalse('google.com/maps' in body)
+
+class TeamsApiPageTest(testutil.TestCase):
+  def testServedByApplication(self):
+    team.TeamTpid(key_name='254', number=254, tpid=1254, year=2018).put()
+    team.TeamTpid(number=1114, tpid=2114, year=2017).put()
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/api/teams?n=254,1114,99999')
+    self.assertTrue(status.startswith('200'))
+    self.assertEqual('application/json', headers['Content-Type'])
+    self.assertEqual({'254': frclinks.TeamPageUrl('1254'),
+                      '1114': frclinks.TeamPageUrl('2114'),
+                      '99999': None}, json.loads(body))
+
+class EventLinksApiPageTest(testutil.TestCase):
+  def testServedByApplication(self):
+    for path in ('/api/event/casj', '/api/events/casj'):
+      status, headers, body = testutil.Get(frclinks.application, path)
+      self.assertTrue(status.startswith('200'))
+      self.assertEqual('application/json', headers['Content-Type'])
+      self.assertEqual(frclinks.GetEventLinks('casj'), json.loads(body))
+
+  def testMatchesRedirectPages(self):
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/api/event/casj/2017')
+    links = json.loads(body)
+    self.assertEqual(frclinks.Resolve('/e/s/casj/2017'), links['schedule'])
+    self.assertEqual(frclinks.Resolve('/e/r/casj/2017'), links['rankings'])
+    self.assertEqual(frclinks.Resolve('/e/tba/casj/2017'), links['tba'])
+    self.assertEqual(frclinks.Resolve('/e/casj/2017'), links['teams'])
+
+  def testBulk(self):
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/api/events?e=casj,onwa/2017%20bad!')
+    self.assertTrue(status.startswith('200'))
+    self.assertEqual({'casj': frclinks.GetEventLinks('casj'),
+                      'onwa/2017': frclinks.GetEventLinks('onwa', '2017'),
+                      'bad!': None}, json.loads(body))
+
+  def testNotModified(self):
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/api/event/casj')
+    status, headers, body = testutil.Get(
+        frclinks.application, '/api/event/casj',
+        headers={'If-None-Match': headers['ETag']})
+    self.assertTrue(status.startswith('304'))
+    self.assertEqual('', body)
+
+  def testRejectsTooManyTeams(self):
+    numbers = ','.join(str(number)
+                       for number in range(1, frclinks.maxApiTeams + 2))
+    rpcCounts = self.CountRpcs()
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/api/teams?n=' + numbers)
+    self.assertTrue(status.startswith('400'))
+    self.assertEqual({}, rpcCounts)
+
+class ExportTeamsPageTest(testutil.TestCase):
+  def testServedUnderTasks(self):
+    team.TeamTpid(key_name='254', number=254, tpid=1254, year=2018).put()
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/tasks/exportteams')
+    self.assertEqual('application/octet-stream', headers['Content-Type'])
+    self.assertEqual(team.ExportTeamSnapshot(), body)
+
+class RouteNamerTest(testutil.TestCase):
+  def setUp(self):
+    testutil.TestCase.setUp(self)
+    self.addCleanup(setattr, stats, 'sampleRate', stats.sampleRate)
+    stats.sampleRate = 1.0
+    self.addCleanup(stats.routeStats.clear)
+    stats.routeStats.clear()
+
+  def testNamesHandlerApplicationServes(self):
+    routeName = frclinks.RouteNamer(frclinks.appRoutes)
+    self.assertEqual('NewFrcLinksRedirectPage', routeName('/t/254'))
+    self.assertEqual('NewFrcLinksRedirectPage', routeName('/nosuchpage'))
+    self.assertEqual('TeamsApiPage', routeName('/api/teams'))
+    self.assertEqual('WarmTeamsPage', routeName('/tasks/warmteams'))
+    self.assertEqual('StatsPage', routeName('/stats'))
+    self.assertEqual('InstructionPage', routeName('/api/nosuchpage'))
+
+  def testRecordsUnderServedRoute(self):
+    testutil.Get(frclinks.application, '/t/254')
+    testutil.Get(frclinks.application, '/api/teams?n=254')
+    self.assertEqual(['NewFrcLinksRedirectPage', 'TeamsApiPage'],
+                     sorted(stats.GetStats()))
+
+class ConcurrencyTest(testutil.TestCase):
+  def testConcurrentRequests(self):
+    teams = [(i + 1000, i) for i in range(1, 501)]
+    for start in (0, 250):
+      team.StoreTeams('2018', start,
+                      testutil.TeamListPage(teams[start:start + 250]))
+    failures = []
+    done = threading.Event()
+
+    def Check(path, expectedStatus, Expect):
+      status, headers, body = testutil.Get(frclinks.application, path)
+      if not status.startswith(expectedStatus) or not Expect(headers, body):
+        failures.append((path, status, body))
+
+    def Serve(seed):
+      generator = random.Random(seed)
+      for i in range(40):
+        numbers = generator.sample(range(1, 601), 3)
+        expected = dict((str(number), number <= 500 and
+                         frclinks.TeamPageUrl(str(number + 1000)) or None)
+                        for number in numbers)
+        Check('/api/teams?n=%d,%d,%d' % tuple(numbers), '200',
+              lambda headers, body: json.loads(body) == expected)
+        Check('/t/%d' % numbers[0], '302',
+              lambda headers, body: headers['Location'] ==
+              'http://frc.link/t/%d' % numbers[0])
+        Check('/api/event/casj', '200',
+              lambda headers, body: 'casj' in body.lower())
+
+    def Invalidate():
+      # Team data changing under the requests mustn't change their answers.
+      while not done.is_set():
+        team.InvalidateTeamCache()
+        time.sleep(0.001)
+
+    invalidator = threading.Thread(target=Invalidate)
+    invalidator.start()
+    servers = [threading.Thread(target=Serve, args=(seed,))
+               for seed in range(8)]
+    for server in servers:
+      server.start()
+    for server in servers:
+      server.join()
+    done.set()
+    invalidator.join()
+    self.assertEqual([], failures)
+
+class FlushTeamsPageTest(testutil.TestCase):
+  def testReportsDone(self):
+    team.TeamTpid(key_name='254', number=254, tpid=1254, year=2018).put()
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/tasks/flushteams')
+    self.assertTrue(body.startswith('Done'))
+    self.assertEqual([], self.QueuedTaskUrls())
+    self.assertEqual(0, team.TeamTpid.all().count())
+
+  def testQueuesContinuation(self):
+    self.addCleanup(setattr, team, 'FlushTeams', team.FlushTeams)
+    team.FlushTeams = lambda: False
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/tasks/flushteams')
+    self.assertTrue('queued' in body)
+    self.assertEqual(['/tasks/flushteams'], self.QueuedTaskUrls())
+
+class WarmTeamsPageTest(testutil.TestCase):
+  def setUp(self):
+    testutil.TestCase.setUp(self)
+    self.filtered = team.lookupStats['filter']
+
+  def testCompletesKnownTeamsAfterFullPass(self):
+    self.StartTeamList([(i + 1000, i) for i in range(1, 301)])
+    testutil.Get(frclinks.application, '/tasks/warmteams')
+    self.assertEqual(['/tasks/migrateteams'], self.QueuedTaskUrls())
+
+    testutil.Get(frclinks.application, '/tasks/migrateteams')
+    self.assertEqual(None, team.LookupTeam('9999'))
+    self.assertEqual(1, team.lookupStats['filter'] - self.filtered)
+    testutil.Get(frclinks.application, '/tasks/warmteams')
+    self.assertEqual(['/tasks/migrateteams'], self.QueuedTaskUrls())
+
+class MigrateTeamsPageTest(testutil.TestCase):
+  def testReportsDone(self):
+    team.TeamTpid(number=1114, tpid=2114, year=2017).put()
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/tasks/migrateteams')
+    self.assertTrue(body.startswith('Done'))
+    self.assertEqual([], self.QueuedTaskUrls())
+    self.assertEqual(2114, team.TeamTpid.get_by_key_name('1114').tpid)
+
+  def testQueuesContinuation(self):
+    self.addCleanup(setattr, team, 'MigrateTeams', team.MigrateTeams)
+    team.MigrateTeams = lambda: False
+    status, headers, body = testutil.Get(frclinks.application,
+                                         '/tasks/migrateteams')
+    self.assertTrue('queued' in body)
+    self.assertEqual(['/tasks/migrateteams'], self.QueuedTaskUrls())
+
+if __name__ == '__main__':
+  unittest.main()
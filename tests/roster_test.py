@@ -0,0 +1,142 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Tests for the cached event rosters.
+"""
+
+import json
+import unittest
+
+import testutil
+
+from google.appengine.api import memcache
+
+import frclinks
+import roster
+import upstream
+
+# Numbers of the teams on the FIRST team list of each stubbed event.
+eventTeams = {
+  'casj': [254, 604, 1114],
+  'onwa': [254, 2910],
+  'curie': [118, 254],
+}
+
+class RosterTestCase(testutil.TestCase):
+  def setUp(self):
+    testutil.TestCase.setUp(self)
+    roster.rosterIndexCache.Clear()
+    self.failingEvents = set()
+    self.server = self.StartServer(self.Respond)
+
+  def Respond(self, path, query):
+    event = path[1:]
+    if event in self.failingEvents:
+      return 500, 'Down'
+    return 200, testutil.TeamListPage(
+        [(number + 1000, number) for number in eventTeams.get(event, [])])
+
+  def TeamListUrl(self, event, year):
+    return '%s/%s' % (self.server.url, event)
+
+  def Scraped(self):
+    return [path[1:] for path, query in self.server.requests]
+
+class ScrapeRostersTest(RosterTestCase):
+  def testCachesRostersAndTeamEvents(self):
+    self.assertTrue(roster.ScrapeRosters('2018', ['CASJ', 'onwa'],
+                                         self.TeamListUrl))
+    self.assertEqual((254, 604, 1114), roster.GetEventRoster('casj', '2018'))
+    self.assertEqual((254, 604, 1114), roster.GetEventRoster('CASJ', '2018'))
+    self.assertEqual(None, roster.GetEventRoster('curie', '2018'))
+    self.assertEqual(['casj', 'onwa'], roster.GetTeamEvents('254', '2018'))
+    self.assertEqual([], roster.GetTeamEvents('118', '2018'))
+
+  def testResumesAfterFailedFetch(self):
+    self.failingEvents.add('onwa')
+    self.assertRaises(upstream.UnavailableError, roster.ScrapeRosters, '2018',
+                      ['casj', 'onwa', 'curie'], self.TeamListUrl)
+    self.assertEqual(1, memcache.get('2018', namespace="RosterProgress"))
+
+    self.failingEvents.clear()
+    del self.server.requests[:]
+    self.assertTrue(roster.ScrapeRosters('2018', ['casj', 'onwa', 'curie'],
+                                         self.TeamListUrl))
+    self.assertEqual(['onwa', 'curie'], self.Scraped())
+    self.assertEqual(['casj', 'curie', 'onwa'],
+                     roster.GetTeamEvents(254, '2018'))
+
+  def testSkipsEventThatKeepsFailing(self):
+    self.failingEvents.add('onwa')
+    events = ['casj', 'onwa', 'curie']
+    for i in range(roster.rosterFetchTries - 1):
+      self.assertRaises(upstream.UnavailableError, roster.ScrapeRosters,
+                        '2018', events, self.TeamListUrl)
+    self.assertTrue(roster.ScrapeRosters('2018', events, self.TeamListUrl))
+    self.assertEqual(['casj', 'curie'], roster.GetTeamEvents(254, '2018'))
+    self.assertEqual(None, roster.GetEventRoster('onwa', '2018'))
+
+    # The next run tries the skipped event afresh.
+    self.failingEvents.clear()
+    self.assertTrue(roster.ScrapeRosters('2018', events, self.TeamListUrl))
+    self.assertEqual((254, 2910), roster.GetEventRoster('onwa', '2018'))
+
+  def testResumesAfterTimeBudget(self):
+    self.assertFalse(roster.ScrapeRosters('2018', ['casj'], self.TeamListUrl,
+                                          timeBudget=0))
+    self.assertEqual([], self.Scraped())
+    self.assertTrue(roster.ScrapeRosters('2018', ['casj'], self.TeamListUrl))
+    self.assertEqual(['casj'], self.Scraped())
+
+class RosterApiTest(RosterTestCase):
+  def setUp(self):
+    RosterTestCase.setUp(self)
+    getUrl = frclinks.EventTeamListPage.__dict__['GetUrl']
+    self.addCleanup(setattr, frclinks.EventTeamListPage, 'GetUrl', getUrl)
+    frclinks.EventTeamListPage.GetUrl = staticmethod(self.TeamListUrl)
+
+  def GetJson(self, path):
+    status, headers, body = testutil.Get(frclinks.application, path)
+    self.assertTrue(status.startswith('200'))
+    self.assertEqual('application/json', headers['Content-Type'])
+    return json.loads(body)
+
+  def testServedByApplication(self):
+    testutil.Get(frclinks.application, '/tasks/rosters')
+    self.assertEqual([254, 604, 1114], self.GetJson('/api/roster/casj'))
+    self.assertEqual([254, 604, 1114], self.GetJson('/api/roster/CASJ'))
+    self.assertEqual(None, self.GetJson('/api/roster/nosuchevent'))
+    # Only events listed in events.json are scraped.
+    self.assertEqual(['casj', 'curie'], self.GetJson('/api/teamevents/254'))
+    self.assertEqual([], self.GetJson('/api/teamevents/9999'))
+
+  def testDivisionAliases(self):
+    # events.json lists Curie by its alias, which the API also accepts.
+    testutil.Get(frclinks.application, '/tasks/rosters')
+    self.assertTrue('curie' in self.Scraped())
+    self.assertFalse('cur' in self.Scraped())
+    self.assertEqual([118, 254], self.GetJson('/api/roster/cur'))
+    self.assertEqual([118, 254], self.GetJson('/api/roster/curie'))
+
+if __name__ == '__main__':
+  unittest.main()
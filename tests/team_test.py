@@ -0,0 +1,397 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Tests for caching and retrieving the location of FIRST team info pages.
+"""
+
+import array
+import threading
+import unittest
+
+import testutil
+
+from google.appengine.api import memcache
+
+import frclinks
+import team
+import upstream
+
+class SnapshotTest(testutil.TestCase):
+  def setUp(self):
+    testutil.TestCase.setUp(self)
+    team.teamSnapshot = array.array('i', [254, 254, 2017, 330, 330, 2017,
+                                          1114, 1114, 2018])
+
+  def testMemcacheShadowsOlderSeasons(self):
+    memcache.set('254', '1254', namespace='Team')
+    memcache.set('1114', '2114', namespace='Team')
+    self.assertEqual('1254', team.LookupTeam('254'))
+    team.teamCache.Clear()
+    self.assertEqual({'254': '1254', '330': '330', '1114': '1114'},
+                     team.LookupTeams(['254', '330', '1114']))
+
+  def testCurrentSeasonAnsweredWithoutRpc(self):
+    rpcCounts = self.CountRpcs()
+    self.assertEqual('1114', team.LookupTeam('1114'))
+    team.teamCache.Clear()
+    self.assertEqual({'1114': '1114'}, team.LookupTeams(['1114']))
+    # Only the cache version stamp is checked.
+    self.assertEqual({'memcache.Get': 1}, rpcCounts)
+
+  def testOlderSeasonsAnswerMemcacheMisses(self):
+    team.LoadKnownTeams()
+    rpcCounts = self.CountRpcs()
+    self.assertEqual('330', team.LookupTeam('330'))
+    # One for the cache version stamp and one for the team.
+    self.assertEqual({'memcache.Get': 2}, rpcCounts)
+
+  def testCurrentSeasonMatchesDefaultYear(self):
+    self.assertEqual(frclinks.defaultYear, str(team.currentSeason))
+
+  def testExportsTeams(self):
+    team.TeamTpid(key_name='254', number=254, tpid=1254, year=2018).put()
+    team.TeamTpid(number=254, tpid=254, year=2017).put()
+    team.TeamTpid(key_name='1', number=1, tpid=1001, year=2018).put()
+    snapshot = array.array('i')
+    snapshot.fromstring(team.ExportTeamSnapshot())
+    self.assertEqual([1, 1001, 2018, 254, 1254, 2018], snapshot.tolist())
+
+class LookupTeamsTest(testutil.TestCase):
+  def testLooksUpKeyedTeams(self):
+    team.TeamTpid(key_name='254', number=254, tpid=1254, year=2018).put()
+    self.assertEqual({'254': '1254', '255': None},
+                     team.LookupTeams(['254', '255']))
+    self.assertEqual('null', memcache.get('255', namespace='Team'))
+
+  def testFallsBackToLegacyRecords(self):
+    team.TeamTpid(number=254, tpid=1254, year=2017).put()
+    team.TeamTpid(number=1114, tpid=2114, year=2017).put()
+    self.assertEqual({'254': '1254', '1114': '2114', '255': None},
+                     team.LookupTeams(['254', '1114', '255']))
+    self.assertEqual('1254', memcache.get('254', namespace='Team'))
+    self.assertEqual('1254', team.LookupTeam('254'))
+
+  def testSkipsLegacyQueriesOnceMigrated(self):
+    team.TeamTpid(key_name='254', number=254, tpid=1254, year=2018).put()
+    team.AddKnownTeams([254, 255], complete=True)
+    rpcCounts = self.CountRpcs()
+    self.assertEqual({'254': '1254', '255': None},
+                     team.LookupTeams(['254', '255']))
+    self.assertEqual(None, team.LookupTeam('255'))
+    self.assertFalse('datastore_v3.RunQuery' in rpcCounts)
+
+class KnownTeamsTest(testutil.TestCase):
+  def testIncompleteBitmapRejectsNothing(self):
+    team.StoreTeams('2018', 0, testutil.TeamListPage([(1001, 1)]))
+    team.TeamTpid(number=254, tpid=1254, year=2012).put()
+    self.assertEqual('1254', team.LookupTeam('254'))
+    team.teamCache.Clear()
+    memcache.flush_all()
+    self.assertEqual({'254': '1254'}, team.LookupTeams(['254']))
+
+  def testKnownTeamsAreAnsweredFromMemcache(self):
+    team.AddKnownTeams([1, 254], complete=True)
+    memcache.set('254', '1254', namespace='Team')
+    rpcCounts = self.CountRpcs()
+    self.assertEqual('1254', team.LookupTeam('254'))
+    team.teamCache.Clear()
+    self.assertEqual({'254': '1254', '255': None},
+                     team.LookupTeams(['254', '255']))
+    self.assertEqual([], [call for call in rpcCounts
+                          if call.startswith('datastore_v3')])
+
+  def testCompleteBitmapRejectsBeforeMemcache(self):
+    team.AddKnownTeams([254], complete=True)
+    self.assertEqual(None, team.LookupTeam('99999'))
+    rpcCounts = self.CountRpcs()
+    for i in range(5):
+      self.assertEqual(None, team.LookupTeam('99999'))
+      self.assertEqual({'99998': None}, team.LookupTeams(['99998']))
+    self.assertEqual({}, rpcCounts)
+
+  def testMigrationCompletesBitmap(self):
+    team.StoreTeams('2018', 0, testutil.TeamListPage([(1001, 1)]))
+    team.TeamTpid(number=254, tpid=1254, year=2012).put()
+    self.assertTrue(team.MigrateTeams())
+    self.assertTrue(team.KnownTeams.get_by_key_name('all').complete)
+    self.assertEqual('1254', team.LookupTeam('254'))
+    rpcCounts = self.CountRpcs()
+    self.assertEqual(None, team.LookupTeam('255'))
+    self.assertEqual(None, team.LookupTeams(['256'])['256'])
+    self.assertEqual([], [call for call in rpcCounts
+                          if call.startswith('datastore_v3')])
+
+  def testStoringKeepsBitmapComplete(self):
+    team.AddKnownTeams([1], complete=True)
+    team.StoreTeams('2018', 0, testutil.TeamListPage([(1254, 254)]))
+    team.knownTeams = None
+    self.assertEqual((True, True), (team.IsKnownTeam(254), team.IsKnownTeam(1)))
+    self.assertFalse(team.IsKnownTeam(255))
+
+class StoreTeamsTest(testutil.TestCase):
+  def testStoresNewTeams(self):
+    teams = [(i + 1000, i) for i in range(1, 251)]
+    team.StoreTeams('2018', 0, testutil.TeamListPage(teams))
+    self.assertEqual('1001', team.LookupTeam('1'))
+    self.assertEqual(2018, team.TeamTpid.get_by_key_name('250').year)
+
+  def testBatchesRpcs(self):
+    # Storing a page takes the same memcache round trips however many teams it
+    # holds. The datastore splits each batch into concurrent RPCs of up to
+    # entityGroupsPerRpc teams, plus one each for the known teams transaction.
+    entityGroupsPerRpc = 10
+    team.StoreTeams('2018', 0, testutil.TeamListPage([(9999, 9999)]))
+    rpcCounts = self.CountRpcs()
+    team.StoreTeams('2018', 0, testutil.TeamListPage(
+        [(i + 1000, i) for i in range(1, 11)]))
+    smallPageRpcs = dict(rpcCounts)
+    rpcCounts.clear()
+    team.StoreTeams('2018', 250, testutil.TeamListPage(
+        [(i + 1000, i) for i in range(11, 261)]))
+    for call in ['datastore_v3.Get', 'datastore_v3.Put']:
+      self.assertEqual(250 / entityGroupsPerRpc + 1, rpcCounts.pop(call))
+      smallPageRpcs.pop(call)
+    self.assertEqual(smallPageRpcs, rpcCounts)
+
+  def testUnchangedPageOnlyReads(self):
+    page = testutil.TeamListPage([(i + 1000, i) for i in range(1, 251)])
+    team.StoreTeams('2018', 0, page)
+    rpcCounts = self.CountRpcs()
+    team.StoreTeams('2018', 0, page)
+    self.assertEqual(['datastore_v3.Get'], rpcCounts.keys())
+
+  def testReturnsCountAndTpid(self):
+    page = testutil.TeamListPage([(i + 1000, i) for i in range(1, 121)])
+    self.assertEqual((120, '1100'), team.StoreTeams('2018', 0, page, 100))
+    self.assertEqual((120, None), team.StoreTeams('2018', 0, page, 999))
+    self.assertEqual((0, None), team.StoreTeams('2018', 250, '', 100))
+    self.assertEqual(120, team.TeamTpid.all().count())
+
+  def testKeepsNewerSeason(self):
+    team.StoreTeams('2018', 0, testutil.TeamListPage([(1254, 254)]))
+    team.StoreTeams('2017', 0, testutil.TeamListPage([(254, 254)]))
+    self.assertEqual(1254, team.TeamTpid.get_by_key_name('254').tpid)
+
+class ScrapeTeamTest(testutil.TestCase):
+  def testReturnsOnceFound(self):
+    teams = [(i + 1000, i) for i in range(1, 5001)]
+    server = self.StartTeamList(teams, latency=0.05)
+    self.assertEqual('1100', team.ScrapeTeam('100', '2018'))
+    # No more than the first round of concurrent fetches was needed.
+    self.assertTrue(len(server.requests) <= team.scrapeConcurrency)
+    self.assertEqual('2018', server.requests[0][1]['season_FRC'])
+    self.assertEqual('1001', team.LookupTeam('1'))
+
+  def testStopsAfterShortPage(self):
+    teams = [(i + 1000, i) for i in range(1, 601)]
+    server = self.StartTeamList(teams)
+    self.assertEqual(None, team.ScrapeTeam('9999', '2018'))
+    starts = sorted(int(query['skip_teams']) for path, query in server.requests)
+    # Pages already in flight when the short page arrives may still be
+    # fetched, but no more are started.
+    self.assertTrue(500 in starts)
+    self.assertTrue(max(starts) < 500 + 250 * team.scrapeConcurrency)
+    self.assertEqual('1600', team.LookupTeam('600'))
+
+  def testFindsTeamOnLaterPage(self):
+    teams = [(i + 1000, i) for i in range(1, 2001)]
+    server = self.StartTeamList(teams)
+    self.assertEqual('2900', team.ScrapeTeam('1900', '2018'))
+    self.assertTrue(len(server.requests) < 2 * team.scrapeConcurrency + 1)
+
+  def testGivesBackSlotsOfPagesInFlight(self):
+    self.addCleanup(setattr, upstream, 'maxConcurrentCalls',
+                    upstream.maxConcurrentCalls)
+    upstream.maxConcurrentCalls = team.scrapeConcurrency
+    teams = [(i + 1000, i) for i in range(1, 2001)]
+    server = self.StartTeamList(teams)
+    # Each scrape returns with pages still in flight, which would use up all
+    # of the host's slots if they weren't given back.
+    for number in range(100, 2001, 100):
+      self.assertEqual(str(number + 1000), team.ScrapeTeam(str(number), '2018'))
+
+  def testScrapesWithFewerSlots(self):
+    self.addCleanup(setattr, upstream, 'maxConcurrentCalls',
+                    upstream.maxConcurrentCalls)
+    upstream.maxConcurrentCalls = 1
+    teams = [(i + 1000, i) for i in range(1, 1001)]
+    self.StartTeamList(teams)
+    self.assertEqual('1900', team.ScrapeTeam('900', '2018'))
+
+class ScrapeTeamOnceTest(testutil.TestCase):
+  def setUp(self):
+    testutil.TestCase.setUp(self)
+    self.flights = team.scrapeStats['flights']
+
+  def testConcurrentMissesShareScrape(self):
+    teams = [(i + 1000, i) for i in range(1, 1001)]
+    server = self.StartTeamList(teams, latency=0.1)
+    tpids = []
+    def Scrape():
+      tpids.append(team.ScrapeTeamOnce('700', '2018'))
+    threads = [threading.Thread(target=Scrape) for i in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(['1700'] * 8, tpids)
+    self.assertEqual(1, team.scrapeStats['flights'] - self.flights)
+    self.assertTrue(len(server.requests) <= team.scrapeConcurrency)
+
+class WarmTeamsTest(testutil.TestCase):
+  def setUp(self):
+    testutil.TestCase.setUp(self)
+    self.teams = [(i + 1000, i) for i in range(1, 1001)]
+    self.server = self.StartTeamList(self.teams)
+
+    # Record which pages are stored rather than skipped.
+    self.storedStarts = []
+    storeTeams = team.StoreTeams
+    def RecordStoreTeams(year, start, content, number=None):
+      self.storedStarts.append(start)
+      return storeTeams(year, start, content, number)
+    self.addCleanup(setattr, team, 'StoreTeams', storeTeams)
+    team.StoreTeams = RecordStoreTeams
+
+  def Warm(self, pages):
+    # The clock is read once at the start and once before each page.
+    return team.WarmTeams('2018', timeBudget=pages + 1,
+                          clock=testutil.FakeClock())
+
+  def testCheckpointsAndResumes(self):
+    self.assertFalse(self.Warm(2))
+    progress = team.TeamIndexProgress.get_by_key_name('2018')
+    self.assertEqual(500, progress.nextStart)
+    self.assertFalse(self.Warm(2))
+    self.assertEqual([0, 250, 500, 750], self.storedStarts)
+    self.assertTrue(self.Warm(2))
+    self.assertEqual([0, 250, 500, 750, 1000], self.storedStarts)
+    progress = team.TeamIndexProgress.get_by_key_name('2018')
+    self.assertEqual(0, progress.nextStart)
+    self.assertEqual(5, len(progress.pageHashes))
+    self.assertEqual('2000', team.LookupTeam('1000'))
+
+  def testSkipsUnchangedPages(self):
+    self.assertTrue(self.Warm(10))
+    self.teams[300] = (9999, 301)
+    self.storedStarts = []
+    self.assertTrue(self.Warm(10))
+    self.assertEqual([250], self.storedStarts)
+    self.assertEqual(5, len(self.server.requests) / 2)
+
+  def testStartsOverAtEndOfList(self):
+    self.assertTrue(self.Warm(10))
+    del self.teams[600:]
+    self.assertTrue(self.Warm(10))
+    progress = team.TeamIndexProgress.get_by_key_name('2018')
+    self.assertEqual(0, progress.nextStart)
+    self.assertEqual(3, len(progress.pageHashes))
+    self.storedStarts = []
+    self.assertTrue(self.Warm(10))
+    self.assertEqual([], self.storedStarts)
+
+class TeamDetailsTest(testutil.TestCase):
+  def testFetchesDetails(self):
+    self.StartSearch({'1254': {'team_city': 'San Jose',
+                               'team_web_url': 'www.team254.com'}})
+    details = team.GetTeamDetails('1254')
+    self.assertEqual('San Jose', details.city)
+    self.assertEqual('', details.country)
+    self.assertEqual('www.team254.com',
+                     team.TeamDetails.get_by_key_name('1254').webUrl)
+
+  def testUnknownTeamHasNoDetails(self):
+    self.StartSearch({})
+    self.assertEqual(None, team.FetchTeamDetails('1254'))
+    self.assertEqual(None, team.GetTeamDetails('1254'))
+
+class PrefetchTeamDetailsTest(testutil.TestCase):
+  def QueriedTpids(self, url):
+    # The tpids are joined with URL-encoded spaces, in no particular order.
+    self.assertTrue(url.startswith('/teams/_search?size='))
+    queryString = url.split('"query":"_id:(')[1].split(')"')[0]
+    return sorted(queryString.split('%20OR%20'))
+
+  def setUp(self):
+    testutil.TestCase.setUp(self)
+    team.StoreTeams('2018', 0, testutil.TeamListPage(
+        [(i + 1000, i) for i in range(1, 8)]))
+    self.server = self.StartSearch(dict(
+        (str(i + 1000), {'team_city': 'City %d' % i}) for i in range(1, 8)))
+
+  def testBatchesQueries(self):
+    self.assertEqual(2, team.PrefetchTeamDetails(['1', '2', '3']))
+    self.assertEqual(1, len(self.server.urls))
+    self.assertEqual(['1001', '1002', '1003'],
+                     self.QueriedTpids(self.server.urls[0]))
+    self.assertTrue('size=3&' in self.server.urls[0])
+    self.assertEqual('City 2', team.GetTeamDetails('1002').city)
+
+  def testSkipsCachedAndUnknownTeams(self):
+    team.FetchTeamDetails('1001')
+    team.TeamDetails(key_name='1002', city='Stored', fetchTime=0.0).put()
+    self.server.urls[:] = []
+    self.assertEqual(4, team.PrefetchTeamDetails(
+        ['1', '2', '3', '4', '5', '6', '7', '9999']))
+    self.assertEqual(1, len(self.server.urls))
+    self.assertEqual(['1003', '1004', '1005', '1006', '1007'],
+                     self.QueriedTpids(self.server.urls[0]))
+    self.assertEqual('Stored', team.GetTeamDetails('1002').city)
+
+  def testSplitsLargeBatches(self):
+    self.addCleanup(setattr, team, 'prefetchBatchSize', team.prefetchBatchSize)
+    team.prefetchBatchSize = 3
+    self.assertEqual(4, team.PrefetchTeamDetails(range(1, 8)))
+    self.assertEqual(3, len(self.server.urls))
+    self.assertEqual(['1001', '1002', '1003', '1004', '1005', '1006', '1007'],
+                     sorted(sum(map(self.QueriedTpids, self.server.urls), [])))
+    self.assertEqual(0, team.PrefetchTeamDetails(range(1, 8)))
+    self.assertEqual(3, len(self.server.urls))
+
+class FlushTeamsTest(testutil.TestCase):
+  def testWarmingAfterFlushRestoresTeams(self):
+    teams = [(i + 1000, i) for i in range(1, 301)]
+    self.StartTeamList(teams)
+    self.assertTrue(team.WarmTeams('2018'))
+    self.assertEqual('1254', team.LookupTeam('254'))
+
+    self.assertTrue(team.FlushTeams())
+    self.assertEqual(0, team.TeamTpid.all().count())
+    self.assertEqual(None, team.TeamIndexProgress.get_by_key_name('2018'))
+    self.assertEqual(None, team.KnownTeams.get_by_key_name('all'))
+    self.assertEqual(None, team.LookupTeam('254'))
+
+    self.assertTrue(team.WarmTeams('2018'))
+    self.assertEqual(300, team.TeamTpid.all().count())
+    self.assertEqual('1254', team.LookupTeam('254'))
+
+  def testDropsCachedLegacyTeams(self):
+    team.TeamTpid(number=1114, tpid=2114, year=2017).put()
+    self.assertEqual('2114', team.LookupTeam('1114'))
+    self.assertTrue(team.FlushTeams())
+    self.assertEqual(0, team.TeamTpid.all().count())
+    self.assertEqual(None, team.LookupTeam('1114'))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,243 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Sets up the App Engine SDK's local service stubs for the tests. Run the tests
+from the application directory with the SDK installed:
+
+  python -m unittest discover -s tests -p '*_test.py'
+"""
+
+import array
+import BaseHTTPServer
+import json
+import os
+import SocketServer
+import sys
+import threading
+import time
+import unittest
+import urlparse
+import wsgiref.util
+from StringIO import StringIO
+
+try:
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+except ImportError:
+  pass
+
+# Selects the template library bundled for the python27 runtime, as in
+# production.
+os.environ.setdefault('APPENGINE_RUNTIME', 'python27')
+
+# The application reads its data files relative to the working directory.
+appDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, appDir)
+os.chdir(appDir)
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import testbed
+
+import team
+import upstream
+
+def TeamListPage(teams):
+  '''
+  Returns a page of the FIRST team list containing the given (tpid, number)
+  pairs.
+  '''
+  return ''.join('<a href="index.lasso?page=team_details&tpid=%d&'
+                 '-session=myarea:TEST"><b>%d</b></a>\n' % team
+                 for team in teams)
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  '''
+  Stands in for an upstream website on a local port, answering each GET with
+  respond(path, query), which returns the status code and content. Waits
+  latency seconds before answering, and records the paths and queries it is
+  asked for in requests, and the raw request paths in urls.
+  '''
+  daemon_threads = True
+
+  def __init__(self, respond, latency=0):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+    self.respond = respond
+    self.latency = latency
+    self.requests = []
+    self.urls = []
+    self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+  def Stop(self):
+    self.shutdown()
+    self.server_close()
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_GET(self):
+    path, query = urlparse.urlsplit(self.path)[2:4]
+    query = dict(urlparse.parse_qsl(query))
+    self.server.requests.append((path, query))
+    self.server.urls.append(self.path)
+    time.sleep(self.server.latency)
+    status, content = self.server.respond(path, query)
+    self.send_response(status)
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, format, *args):
+    pass
+
+def TeamListResponder(teams):
+  '''
+  Returns a responder for StubServer that serves the given (tpid, number) pairs
+  as the FIRST list of all teams, 250 to a page.
+  '''
+  def Respond(path, query):
+    start = int(query.get('skip_teams', 0))
+    return 200, TeamListPage(teams[start:start + 250])
+  return Respond
+
+def SearchResponder(detailsByTpid):
+  '''
+  Returns a responder for StubServer that answers FIRST team searches for the
+  given tpids with the given details, in the form of its '_source' field.
+  '''
+  def Respond(path, query):
+    queryString = json.loads(query['source'])['query']['query_string']['query']
+    tpids = queryString[len('_id:('):-len(')')].split(' OR ')
+    return 200, json.dumps({'hits': {'hits': [
+        {'_id': tpid, '_source': detailsByTpid[tpid]}
+        for tpid in tpids if tpid in detailsByTpid]}})
+  return Respond
+
+def Get(app, path, headers={}):
+  '''
+  Serves a GET of the given path, which may include a query string, with the
+  given WSGI application and request headers, returning the status, headers and
+  body.
+  '''
+  path, separator, query = path.partition('?')
+  environ = {
+    'REQUEST_METHOD': 'GET',
+    'PATH_INFO': path,
+    'QUERY_STRING': query,
+    'wsgi.input': StringIO(),
+  }
+  for name, value in headers.iteritems():
+    environ['HTTP_' + name.upper().replace('-', '_')] = value
+  wsgiref.util.setup_testing_defaults(environ)
+  response = []
+  def StartResponse(status, headers):
+    response.extend([status, headers])
+  body = ''.join(app(environ, StartResponse))
+  return response[0], dict(response[1]), body
+
+class FakeClock(object):
+  '''
+  Stands in for time.time, advancing by step seconds each time it is read.
+  '''
+  def __init__(self, step=1):
+    self.now = 0
+    self.step = step
+
+  def __call__(self):
+    self.now += self.step
+    return self.now
+
+class TestCase(unittest.TestCase):
+  '''
+  Runs each test against fresh service stubs and module caches.
+  '''
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    self.testbed.init_taskqueue_stub()
+    self.testbed.init_urlfetch_stub()
+
+    team.teamCache.Clear()
+    team.teamCacheVersion = None
+    team.teamCacheCheckTime = 0
+    team.knownTeams = None
+    # Don't let a bundled teams.bin answer lookups.
+    team.teamSnapshot = array.array('i')
+    team.scrapeFlights.clear()
+    upstream.hosts.clear()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def StartServer(self, respond, latency=0):
+    '''
+    Starts a StubServer for the rest of the test, returning it.
+    '''
+    server = StubServer(respond, latency)
+    self.addCleanup(server.Stop)
+    return server
+
+  def StartTeamList(self, teams, latency=0):
+    '''
+    Points team.py at a StubServer serving the given teams as the FIRST list of
+    all teams for the rest of the test, returning the server.
+    '''
+    server = self.StartServer(TeamListResponder(teams), latency)
+    self.addCleanup(setattr, team, 'teamListUrl', team.teamListUrl)
+    team.teamListUrl = server.url + '/myarea/index.lasso'
+    return server
+
+  def StartSearch(self, detailsByTpid):
+    '''
+    Points team.py at a StubServer answering FIRST team searches with the given
+    details by tpid for the rest of the test, returning the server.
+    '''
+    server = self.StartServer(SearchResponder(detailsByTpid))
+    self.addCleanup(setattr, team, 'teamSearchUrl', team.teamSearchUrl)
+    team.teamSearchUrl = server.url + '/teams/_search'
+    return server
+
+  def QueuedTaskUrls(self):
+    '''
+    Returns the URLs of the tasks queued so far.
+    '''
+    taskqueueStub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    return [task.url for task in taskqueueStub.get_filtered_tasks()]
+
+  def CountRpcs(self):
+    '''
+    Returns a dict that counts each API call made from now on by
+    'service.call'.
+    '''
+    rpcCounts = {}
+    def Hook(service, call, request, response):
+      name = service + '.' + call
+      rpcCounts[name] = rpcCounts.get(name, 0) + 1
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('count', Hook)
+    return rpcCounts
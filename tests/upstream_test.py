@@ -0,0 +1,147 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Tests for calls to upstream websites.
+"""
+
+import threading
+import unittest
+
+import testutil
+
+import upstream
+
+class CircuitBreakerTest(testutil.TestCase):
+  def setUp(self):
+    super(CircuitBreakerTest, self).setUp()
+    self.server = self.StartServer(lambda path, query: (500, 'Down'))
+    self.url = self.server.url + '/'
+
+  def testServerErrorsOpenCircuit(self):
+    for i in range(upstream.failureThreshold):
+      self.assertRaises(upstream.UnavailableError, upstream.Fetch, self.url)
+    self.assertEqual(upstream.failureThreshold, len(self.server.requests))
+
+    # Calls fail fast without reaching the server while the circuit is open.
+    self.assertRaises(upstream.UnavailableError, upstream.Fetch, self.url)
+    self.assertRaises(upstream.UnavailableError, upstream.CreateFetchRpc,
+                      self.url)
+    self.assertEqual(upstream.failureThreshold, len(self.server.requests))
+
+  def testAsyncServerErrorsOpenCircuit(self):
+    for i in range(upstream.failureThreshold):
+      rpc = upstream.CreateFetchRpc(self.url)
+      self.assertRaises(upstream.UnavailableError, upstream.GetResult, rpc)
+    self.assertRaises(upstream.UnavailableError, upstream.CreateFetchRpc,
+                      self.url)
+    self.assertEqual(upstream.failureThreshold, len(self.server.requests))
+
+  def testSuccessResetsFailures(self):
+    for i in range(upstream.failureThreshold - 1):
+      self.assertRaises(upstream.UnavailableError, upstream.Fetch, self.url)
+    self.server.respond = lambda path, query: (200, 'Up')
+    self.assertEqual('Up', upstream.Fetch(self.url).content)
+
+    self.server.respond = lambda path, query: (500, 'Down')
+    self.assertRaises(upstream.UnavailableError, upstream.Fetch, self.url)
+    self.assertEqual(upstream.failureThreshold + 1, len(self.server.requests))
+
+  def OpenCircuit(self):
+    for i in range(upstream.failureThreshold):
+      self.assertRaises(upstream.UnavailableError, upstream.Fetch, self.url)
+    # Let the open period run out.
+    upstream.GetHost(self.url).openUntil = 0
+
+  def testLetsOneTrialCallThrough(self):
+    self.OpenCircuit()
+    trial = upstream.CreateFetchRpc(self.url)
+    self.assertRaises(upstream.UnavailableError, upstream.Fetch, self.url)
+    self.assertRaises(upstream.UnavailableError, upstream.CreateFetchRpc,
+                      self.url)
+
+    # A successful trial closes the circuit.
+    self.server.respond = lambda path, query: (200, 'Up')
+    self.assertEqual('Up', upstream.GetResult(trial).content)
+    self.assertEqual('Up', upstream.Fetch(self.url).content)
+    self.assertEqual('Up', upstream.Fetch(self.url).content)
+
+  def testFailedTrialReopensCircuit(self):
+    self.OpenCircuit()
+    self.assertRaises(upstream.UnavailableError, upstream.Fetch, self.url)
+    requestCount = len(self.server.requests)
+    self.server.respond = lambda path, query: (200, 'Up')
+    self.assertRaises(upstream.UnavailableError, upstream.Fetch, self.url)
+    self.assertEqual(requestCount, len(self.server.requests))
+
+class SlotsTest(testutil.TestCase):
+  def setUp(self):
+    super(SlotsTest, self).setUp()
+    self.addCleanup(setattr, upstream, 'maxConcurrentCalls',
+                    upstream.maxConcurrentCalls)
+    upstream.maxConcurrentCalls = 2
+    self.server = self.StartServer(lambda path, query: (200, 'Up'))
+    self.url = self.server.url + '/'
+
+  def testAsyncCallsHoldSlots(self):
+    rpcs = [upstream.CreateFetchRpc(self.url) for i in range(2)]
+    self.assertRaises(upstream.UnavailableError, upstream.CreateFetchRpc,
+                      self.url)
+    self.assertRaises(upstream.UnavailableError, upstream.Fetch, self.url)
+
+    self.assertEqual('Up', upstream.GetResult(rpcs[0]).content)
+    rpcs.append(upstream.CreateFetchRpc(self.url))
+    for rpc in rpcs[1:]:
+      self.assertEqual('Up', upstream.GetResult(rpc).content)
+    self.assertEqual('Up', upstream.Fetch(self.url).content)
+
+  def testReleaseGivesBackSlotOnce(self):
+    rpc = upstream.CreateFetchRpc(self.url)
+    upstream.Release(rpc)
+    upstream.Release(rpc)
+    # Waiting on a released RPC must not give its slot back again either; the
+    # bounded semaphore raises ValueError if it does.
+    upstream.GetResult(rpc)
+    rpcs = [upstream.CreateFetchRpc(self.url) for i in range(2)]
+    self.assertRaises(upstream.UnavailableError, upstream.CreateFetchRpc,
+                      self.url)
+    for rpc in rpcs:
+      upstream.Release(rpc)
+
+  def testFetchFromThreadsIsLimited(self):
+    self.server.latency = 0.2
+    results = []
+    def Call():
+      try:
+        upstream.Fetch(self.url)
+        results.append(True)
+      except upstream.UnavailableError:
+        results.append(False)
+    threads = [threading.Thread(target=Call) for i in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual([False, False, True, True], sorted(results))
+
+if __name__ == '__main__':
+  unittest.main()
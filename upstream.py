@@ -0,0 +1,210 @@
+# Copyright 2008 Patrick Fairbank. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Provides a guarded way of calling the FIRST website and other upstream hosts,
+so that a slow or failing host makes requests fail fast instead of tying up
+instances.
+"""
+
+import threading
+import time
+import urlparse
+
+from google.appengine.api import urlfetch
+
+from stats import Timed
+
+# Bounds on the deadline given to upstream calls, in seconds. Within them, the
+# deadline adapts to a multiple of each host's recent latency.
+minDeadline = 2
+maxDeadline = 10
+deadlineLatencyMultiple = 4
+
+# Number of calls that may be in flight to one host at once.
+maxConcurrentCalls = 8
+
+# Number of consecutive failures after which a host's circuit breaker opens, and
+# how long it stays open before a single trial call is let through, in seconds.
+# Everyone else keeps failing fast until the trial succeeds, which closes the
+# breaker, or fails, which opens it again. A trial that never reports back is
+# replaced by another once openSeconds pass.
+failureThreshold = 5
+openSeconds = 30
+
+class UnavailableError(Exception):
+  '''
+  Raised when an upstream host can't be called or the call fails.
+  '''
+
+class Host(object):
+  '''
+  Tracks calls to one upstream host: limits how many are in flight, adapts the
+  deadline to its recent latency, and opens a circuit breaker after repeated
+  failures so that callers fail fast while it is down.
+  '''
+  def __init__(self, name):
+    self.name = name
+    self.slots = threading.BoundedSemaphore(maxConcurrentCalls)
+    self.lock = threading.Lock()
+    self.latency = None
+    self.failures = 0
+    self.openUntil = 0
+
+  def Deadline(self):
+    '''
+    Returns the deadline to give the next call to this host.
+    '''
+    with self.lock:
+      if self.latency is None:
+        return maxDeadline
+      return min(maxDeadline,
+                 max(minDeadline, self.latency * deadlineLatencyMultiple))
+
+  def CheckCircuit(self):
+    '''
+    Raises UnavailableError if this host's circuit breaker is open. Once it has
+    been open for openSeconds, lets one caller through as a trial call.
+    '''
+    with self.lock:
+      if self.failures < failureThreshold:
+        return
+      now = time.time()
+      if now < self.openUntil:
+        raise UnavailableError('Circuit open for ' + self.name)
+      # Half open: hold the breaker open for everyone else while the trial call
+      # is made.
+      self.openUntil = now + openSeconds
+
+  def Record(self, latency, success):
+    '''
+    Records the outcome of a call to this host.
+    '''
+    with self.lock:
+      if success:
+        self.failures = 0
+        if self.latency is None:
+          self.latency = latency
+        else:
+          self.latency = 0.8 * self.latency + 0.2 * latency
+      else:
+        self.failures += 1
+        if self.failures >= failureThreshold:
+          self.openUntil = time.time() + openSeconds
+
+# Upstream hosts called by this instance, keyed by host name.
+hosts = {}
+hostsLock = threading.Lock()
+
+def GetHost(url):
+  '''
+  Returns the Host tracking calls to the host of the given URL.
+  '''
+  name = urlparse.urlsplit(url).netloc
+  with hostsLock:
+    if name not in hosts:
+      hosts[name] = Host(name)
+    return hosts[name]
+
+@Timed('urlfetch')
+def Fetch(url, headers={}):
+  '''
+  Fetches the given URL, raising UnavailableError if its host's circuit breaker
+  is open, too many calls to it are already in flight, or the call fails.
+  '''
+  host = GetHost(url)
+  host.CheckCircuit()
+  if not host.slots.acquire(False):
+    raise UnavailableError('Too many calls in flight to ' + host.name)
+  try:
+    startTime = time.time()
+    try:
+      response = urlfetch.fetch(url, deadline=host.Deadline(), headers=headers)
+    except urlfetch.Error, e:
+      host.Record(time.time() - startTime, False)
+      raise UnavailableError(str(e))
+    host.Record(time.time() - startTime, response.status_code < 500)
+    if response.status_code >= 500:
+      raise UnavailableError('%s returned %d' % (host.name, response.status_code))
+    return response
+  finally:
+    host.slots.release()
+
+def CreateFetchRpc(url, headers={}):
+  '''
+  Starts an asynchronous fetch of the given URL, returning the RPC. Raises
+  UnavailableError if its host's circuit breaker is open or too many calls to it
+  are already in flight. Pass the RPC to GetResult to wait for the response, or
+  to Release if it won't be waited on.
+  '''
+  host = GetHost(url)
+  host.CheckCircuit()
+  if not host.slots.acquire(False):
+    raise UnavailableError('Too many calls in flight to ' + host.name)
+  startTime = time.time()
+  rpc = urlfetch.create_rpc(deadline=host.Deadline())
+  rpc.host = host
+  rpc.holdsSlot = True
+
+  def RecordResult():
+    try:
+      success = rpc.get_result().status_code < 500
+    except urlfetch.Error:
+      success = False
+    host.Record(time.time() - startTime, success)
+    Release(rpc)
+
+  rpc.callback = RecordResult
+  try:
+    urlfetch.make_fetch_call(rpc, url, headers=headers)
+  except:
+    Release(rpc)
+    raise
+  return rpc
+
+def Release(rpc):
+  '''
+  Gives back the slot held by an RPC started by CreateFetchRpc. Safe to call
+  more than once.
+  '''
+  with rpc.host.lock:
+    holdsSlot = rpc.holdsSlot
+    rpc.holdsSlot = False
+  if holdsSlot:
+    rpc.host.slots.release()
+
+@Timed('urlfetch')
+def GetResult(rpc):
+  '''
+  Waits for and returns the response of an RPC started by CreateFetchRpc,
+  raising UnavailableError if the call failed.
+  '''
+  try:
+    response = rpc.get_result()
+  except urlfetch.Error, e:
+    raise UnavailableError(str(e))
+  finally:
+    Release(rpc)
+  if response.status_code >= 500:
+    raise UnavailableError('Upstream returned %d' % response.status_code)
+  return response